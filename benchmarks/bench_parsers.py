@@ -0,0 +1,47 @@
+"""
+Benchmarks the HTML parser backends against the saved InternSG fixtures.
+
+    python -m benchmarks.bench_parsers [--iterations 200]
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from scraper.parsers import PARSERS
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures"
+
+
+def bench_parser(parser, pages, iterations):
+    """Parses every page `iterations` times and returns (pages/s, rows/s)."""
+    rows = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for html in pages:
+            rows += len(parser.parse(html))
+    elapsed = time.perf_counter() - start
+    return iterations * len(pages) / elapsed, rows / elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--iterations", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    # Per-row logging would dominate the timings
+    logging.disable(logging.CRITICAL)
+
+    pages = [path.read_text(encoding="utf-8") for path in sorted(FIXTURES.glob("internsg_*.html"))]
+    baseline = None
+
+    print(f"{len(pages)} fixture pages x {args.iterations} iterations")
+    print(f"{'backend':<14}{'pages/s':>12}{'rows/s':>14}{'speedup':>10}")
+    for name, parser in PARSERS.items():
+        pages_per_s, rows_per_s = bench_parser(parser, pages, args.iterations)
+        baseline = baseline or pages_per_s
+        print(f"{name:<14}{pages_per_s:>12.1f}{rows_per_s:>14.1f}{pages_per_s / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
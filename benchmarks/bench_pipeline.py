@@ -0,0 +1,235 @@
+"""
+Load-tests the scrape -> dedup -> notify pipeline against local stand-ins for InternSG, Telegram and Postgres.
+
+    python -m benchmarks.bench_pipeline [--users 2000] [--roles 50] [--ticks 3] [--save run.json] [--baseline run.json]
+
+Users sign up through the real conversation handlers (the first --handler-users of them) or a bulk insert,
+then every tick adds new postings to the fixture site and runs the alert cycle for every shard.
+Postgres is BENCH_DSN when set (its tables are truncated) or a throwaway server.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+from benchmarks.fakes import CountingCursor, FakeBotApi, FixtureSite, disposable_postgres, use_dsn
+
+SUMMARY_METRICS = (
+    ("crawl_p50_ms", "crawl p50 (ms)"),
+    ("crawl_p95_ms", "crawl p95 (ms)"),
+    ("first_alert_ms", "first alert (ms)"),
+    ("http_requests_per_tick", "HTTP requests/tick"),
+    ("db_statements_per_tick", "DB statements/tick"),
+    ("messages_per_s", "messages/s"),
+    ("peak_rss_mb", "peak RSS (MB)"),
+)
+
+
+def configure_environment(args, site, bot_api, dsn):
+    """Points the bot at the stand-ins. Must run before anything under bot/ is imported."""
+    use_dsn(dsn)
+    os.environ["INTERNSG_URL"] = site.url
+    os.environ["BOT_TOKEN"] = bot_api.token
+    os.environ["TELEGRAM_BASE_URL"] = bot_api.base_url
+    os.environ["SCRAPER_CACHE_TTL"] = "0"  # Every tick goes back to the site
+    os.environ["KEYWORD_POLL_MIN"] = "0"  # Every keyword is due on every tick
+    os.environ["SCRAPER_MATCH_MODE"] = args.match_mode
+    if not args.telegram_limits:
+        # Measure the pipeline, not Telegram's flood limits
+        os.environ["TELEGRAM_GLOBAL_RATE"] = "1000000"
+        os.environ["TELEGRAM_CHAT_INTERVAL"] = "0"
+
+
+def command_update(update_id, chat_id, text):
+    message = {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+def timed(func, samples):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KiB on Linux
+
+
+async def run_benchmark(args, site, bot_api):
+    # Imported here so bot.config picks up the stand-in settings
+    from telegram import Update
+    from telegram.ext import Application
+    from psycopg2.extras import execute_values
+    import bot.handlers as handlers
+    import scraper.scraper as scraper
+    from bot.bot import on_shutdown, on_startup
+    from bot.config import db_cursor, db_pool
+    from bot.migrations import apply_migrations
+
+    db_pool.cursor_factory = CountingCursor
+    with db_cursor() as cursor:
+        apply_migrations(cursor)
+        cursor.execute("TRUNCATE users, users_jobs_sent, jobs, keywords, alert_shards, digest_queue, job_keywords, telegram_senders, alert_outbox")
+
+    rng = random.Random(args.seed)
+    roles = [f"role {i}" for i in range(args.roles)]
+    users = {chat_id: rng.sample(roles, args.roles_per_user) for chat_id in range(1, args.users + 1)}
+
+    app = Application.builder().token(bot_api.token).base_url(bot_api.base_url).build()
+    handlers.register_handlers(app)
+    await app.initialize()
+
+    # Sign-ups: a sample through the real conversation handlers, the rest in bulk
+    signup_users = list(users)[:args.handler_users]
+    start = time.perf_counter()
+    update_id = 0
+    for chat_id in signup_users:
+        for text in ["/start", *users[chat_id], "done"]:
+            update_id += 1
+            await app.process_update(Update.de_json(command_update(update_id, chat_id, text), app.bot))
+    signup_s = time.perf_counter() - start
+
+    bulk = [(chat_id, roles_) for chat_id, roles_ in users.items() if chat_id not in set(signup_users)]
+    if bulk:
+        with db_cursor() as cursor:
+            execute_values(cursor, "INSERT INTO users (chat_id, roles) VALUES %s", bulk, page_size=1000)
+    if args.digest != "off":
+        with db_cursor() as cursor:
+            cursor.execute("UPDATE users SET digest = %s", (args.digest,))
+
+    await on_startup(app)  # Warms the profile cache and starts the dispatcher, as in production
+    dispatcher = app.bot_data["dispatcher"]
+
+    crawl_samples = []  # One per keyword crawl (the full listing's in local mode)
+    scraper.INTERNSG.crawl = timed(scraper.INTERNSG.crawl, crawl_samples)
+    shards = [None] if args.match_mode == "local" else list(range(handlers.ALERT_SHARDS))
+
+    site.add_postings(roles, args.backfill)
+    ticks = []
+    for tick in range(args.ticks + 1):
+        if tick:
+            site.add_postings(roles, args.new_per_tick)
+        statements, requests, sent = CountingCursor.executed, site.requests, bot_api.sent
+        crawl_samples.clear()
+
+        start = time.perf_counter()
+        for shard in shards:
+            await handlers.check_jobs_for_all_users(dispatcher, shard=shard)
+        cycle_s = time.perf_counter() - start
+        await dispatcher.stop()  # Drains the queue and records every delivery
+        total_s = time.perf_counter() - start
+        await dispatcher.start()
+
+        messages = bot_api.sent - sent
+        ticks.append({
+            "tick": "cold" if tick == 0 else tick,
+            "cycle_s": cycle_s,
+            "total_s": total_s,
+            "first_alert_s": bot_api.sent_at[sent] - start if messages else None,
+            "crawl_ms": [sample * 1000 for sample in crawl_samples],
+            "http_requests": site.requests - requests,
+            "db_statements": CountingCursor.executed - statements,
+            "messages": messages,
+            "messages_per_s": messages / total_s if total_s else 0.0,
+        })
+
+    await on_shutdown(app)
+    await app.shutdown()
+    return {"signup_s": signup_s, "signup_users": len(signup_users), "ticks": ticks}
+
+
+def summarize(args, result):
+    warm = result["ticks"][1:] or result["ticks"]
+    crawl_ms = sorted(sample for tick in warm for sample in tick["crawl_ms"]) or [0.0]
+    first_alerts = [tick["first_alert_s"] for tick in warm if tick["first_alert_s"] is not None] or [0.0]
+    messages = sum(tick["messages"] for tick in warm)
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("save", "baseline")},
+        "crawl_p50_ms": statistics.median(crawl_ms),
+        "crawl_p95_ms": crawl_ms[min(len(crawl_ms) - 1, int(len(crawl_ms) * 0.95))],
+        "first_alert_ms": statistics.mean(first_alerts) * 1000,
+        "http_requests_per_tick": statistics.mean(tick["http_requests"] for tick in warm),
+        "db_statements_per_tick": statistics.mean(tick["db_statements"] for tick in warm),
+        "messages_per_s": messages / sum(tick["total_s"] for tick in warm),
+        "peak_rss_mb": peak_rss_mb(),
+        "signups_per_s": result["signup_users"] / result["signup_s"] if result["signup_s"] else 0.0,
+    }
+
+
+def print_report(result, summary, baseline=None):
+    print(f"{'tick':>5}{'cycle s':>10}{'total s':>10}{'1st alert':>10}{'requests':>10}{'DB stmts':>10}{'messages':>10}{'msg/s':>10}")
+    for tick in result["ticks"]:
+        first_alert = f"{tick['first_alert_s']:.2f}" if tick["first_alert_s"] is not None else "-"
+        print(f"{tick['tick']:>5}{tick['cycle_s']:>10.2f}{tick['total_s']:>10.2f}{first_alert:>10}{tick['http_requests']:>10}"
+              f"{tick['db_statements']:>10}{tick['messages']:>10}{tick['messages_per_s']:>10.0f}")
+
+    print(f"\nsign-ups through handlers: {summary['signups_per_s']:.1f}/s ({result['signup_users']} users)")
+    for key, label in SUMMARY_METRICS:
+        line = f"{label:<22}{summary[key]:>12.1f}"
+        if baseline and baseline.get(key):
+            line += f"   baseline {baseline[key]:>10.1f}  ({(summary[key] / baseline[key] - 1) * 100:+.1f}%)"
+        print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--users", type=int, default=2000)
+    arg_parser.add_argument("--roles", type=int, default=50, help="distinct roles in the population")
+    arg_parser.add_argument("--roles-per-user", type=int, default=3)
+    arg_parser.add_argument("--handler-users", type=int, default=100, help="users signed up through the handlers")
+    arg_parser.add_argument("--ticks", type=int, default=3, help="warm ticks after the cold baseline tick")
+    arg_parser.add_argument("--backfill", type=int, default=20, help="postings per role before the first tick")
+    arg_parser.add_argument("--new-per-tick", type=int, default=2, help="new postings per role per tick")
+    arg_parser.add_argument("--match-mode", choices=("search", "local"), default="search")
+    arg_parser.add_argument("--digest", choices=("off", "immediate"), default="off", help="every user's digest mode")
+    arg_parser.add_argument("--telegram-limits", action="store_true", help="keep the real per-chat and global rate limits")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    arg_parser.add_argument("--save", help="write the summary to this JSON file")
+    arg_parser.add_argument("--baseline", help="compare against a summary saved with --save")
+    args = arg_parser.parse_args()
+
+    # Per-row and per-request logging would dominate the timings
+    logging.basicConfig(level=logging.WARNING)
+    logging.disable(logging.INFO)
+
+    site = FixtureSite().start()
+    bot_api = FakeBotApi().start()
+    try:
+        with disposable_postgres() as dsn:
+            configure_environment(args, site, bot_api, dsn)
+            result = asyncio.run(run_benchmark(args, site, bot_api))
+    finally:
+        site.stop()
+        bot_api.stop()
+
+    summary = summarize(args, result)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, summary, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Local stand-ins for the services the alert pipeline talks to: InternSG, the Telegram Bot API and Postgres.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import psycopg2.extensions
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures"
+
+ROW_RE = re.compile(r'  <div class="ast-row list-(?:odd|even)">.*?\n  </div>\n', re.S)
+HREF_RE = re.compile(r'href="https://www\.internsg\.com/job/[^"/]*/')
+TITLE_RE = re.compile(r'(<a href="[^"]*">)[^<]*(</a>)')
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real services
+    wbufsize = -1  # Headers and body go out in one write, flushed after each request
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server:
+    """Runs a ThreadingHTTPServer on a free localhost port in a daemon thread."""
+
+    handler = None
+
+    def start(self):
+        owner = self
+
+        class Handler(self.handler):
+            server_owner = owner
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _SiteHandler(_QuietHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        keyword = urllib.parse.parse_qs(url.query).get("filter_s", [""])[0]
+        match = re.match(r"/jobs/(\d+)/", url.path)
+        page = int(match.group(1)) if match else 1
+        self.send_body(self.server_owner.render(keyword, page).encode("utf-8"), "text/html; charset=utf-8")
+
+
+class FixtureSite(_Server):
+    """
+    Serves InternSG listing pages built from the saved fixture's markup.
+    Postings are synthetic (title "<Role> Intern #<n>", unique link per posting) so a run can add new ones per tick.
+    Searching for a role lists that role's postings; an empty search lists all of them, newest first.
+    """
+
+    handler = _SiteHandler
+
+    def __init__(self, fixture="internsg_software.html"):
+        html = (FIXTURES / fixture).read_text(encoding="utf-8")
+        rows = ROW_RE.findall(html)
+        self.per_page = len(rows)
+        self._rows = rows
+        self._head = html[:html.index(rows[0])]
+        self._tail = html[html.index(rows[-1]) + len(rows[-1]):]
+        self._postings = []  # (number, role), oldest first
+        self._by_role = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def add_postings(self, roles, per_role):
+        with self._lock:
+            for _ in range(per_role):
+                for role in roles:
+                    posting = (len(self._postings), role)
+                    self._postings.append(posting)
+                    self._by_role.setdefault(role, []).append(posting)
+
+    def render(self, keyword, page):
+        with self._lock:
+            self.requests += 1
+            postings = self._by_role.get(keyword, []) if keyword else self._postings
+            end = len(postings) - (page - 1) * self.per_page
+            selected = postings[max(0, end - self.per_page):max(0, end)][::-1]
+
+        rows = []
+        for number, role in selected:
+            row = self._rows[number % len(self._rows)]
+            row = HREF_RE.sub(f'href="https://www.internsg.com/job/bench-{number}/', row)
+            row = TITLE_RE.sub(lambda m: f"{m.group(1)}{role.title()} Intern #{number}{m.group(2)}", row)
+            rows.append(row)
+        return self._head + "".join(rows) + self._tail
+
+
+class _BotApiHandler(_QuietHandler):
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        if "json" in self.headers.get("Content-Type", ""):
+            params = json.loads(body or "{}")
+        else:
+            params = {key: values[0] for key, values in urllib.parse.parse_qs(body).items()}
+        result = self.server_owner.handle(method, params)
+        self.send_body(json.dumps({"ok": True, "result": result}).encode("utf-8"), "application/json")
+
+    do_GET = do_POST
+
+
+class FakeBotApi(_Server):
+    """Minimal Telegram Bot API: answers getMe and counts sendMessage / editMessageText calls."""
+
+    handler = _BotApiHandler
+    token = "123456:bench"
+
+    def __init__(self):
+        self.sent = 0
+        self.sent_at = []  # perf_counter() of every sendMessage, in arrival order
+        self.edits = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"{self.url}/bot"
+
+    def handle(self, method, params):
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            with self._lock:
+                if method == "sendMessage":
+                    self.sent += 1
+                    self.sent_at.append(time.perf_counter())
+                else:
+                    self.edits += 1
+                message_id = self.sent + self.edits
+            chat_id = int(params.get("chat_id", 0))
+            return {
+                "message_id": message_id, "date": 0, "text": params.get("text", ""),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+        return True
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Counts statements sent to Postgres, for DB round trips per tick."""
+
+    executed = 0
+    _lock = threading.Lock()
+
+    def execute(self, query, vars=None):
+        with CountingCursor._lock:
+            CountingCursor.executed += 1
+        return super().execute(query, vars)
+
+
+@contextmanager
+def disposable_postgres():
+    """
+    Yields a DSN: BENCH_DSN if set (its tables get truncated), otherwise a throwaway server
+    started with pgserver or the local initdb/pg_ctl binaries and removed afterwards.
+    """
+    dsn = os.getenv("BENCH_DSN")
+    if dsn:
+        yield dsn
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench-pg-") as pgdata:
+        try:
+            import pgserver
+        except ImportError:
+            pgserver = None
+
+        if pgserver is not None:
+            server = pgserver.get_server(pgdata, cleanup_mode="stop")
+            try:
+                yield server.get_uri()
+            finally:
+                server.cleanup()
+            return
+
+        if not shutil.which("initdb") or not shutil.which("pg_ctl"):
+            raise SystemExit("No Postgres available: set BENCH_DSN, `pip install pgserver` or install PostgreSQL")
+
+        subprocess.run(["initdb", "-D", pgdata, "-U", "postgres", "--auth=trust"], check=True, capture_output=True)
+        options = f"-k {pgdata} -c listen_addresses=''"
+        subprocess.run(["pg_ctl", "-D", pgdata, "-o", options, "-w", "start"], check=True, capture_output=True)
+        try:
+            yield f"host={pgdata} dbname=postgres user=postgres"
+        finally:
+            subprocess.run(["pg_ctl", "-D", pgdata, "-m", "immediate", "stop"], capture_output=True)
+
+
+def use_dsn(dsn):
+    """Points bot.config's DB_* settings at `dsn`; must run before bot is imported."""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    for env, key in (("DB_NAME", "dbname"), ("DB_USER", "user"), ("DB_PASS", "password"),
+                     ("DB_HOST", "host"), ("DB_PORT", "port")):
+        if params.get(key):
+            os.environ[env] = params[key]
+        else:
+            os.environ.pop(env, None)
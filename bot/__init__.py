@@ -1,9 +1,4 @@
-import os
 from dotenv import load_dotenv
-from bot.config import init_db
 
-# Load environment variables
+# Load environment variables. Importing bot has no other side effects: the schema is set up by bot.migrations
 load_dotenv()
-
-# Ensure database setup
-init_db()
@@ -1,28 +1,152 @@
 import os
-from telegram.ext import Application, CommandHandler
-from bot.handlers import register_handlers, start_user_scheduler
+import socket
+import asyncio
+from urllib.parse import urlparse
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler
+from bot.handlers import (
+    mark_startup, record_delivered_messages, record_dropped_messages, register_handlers, start_digest_job,
+    start_retention_job, start_user_scheduler
+)
+from bot.migrations import apply_migrations
+from bot.dispatcher import MessageDispatcher
+from bot.config import db_pool, run_db
+from bot.profiles import load_all_profiles, profile_cache
+from scraper.utils import close_async_client
+from metrics import start_metrics_server
 import logging
 
 # Load environment variables
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Point at a local fake Bot API server for offline testing
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+# "bot" runs the alert loop in this process; "workers" leaves it to `python -m bot.worker` processes
+ALERT_RUNNER = os.getenv("ALERT_RUNNER", "bot")
+SENDER_ID = f"bot:{socket.gethostname()}:{os.getpid()}"  # Registered in telegram_senders to share the send rate
+# Serves Prometheus metrics on this port when set
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# DEBUG adds per-row, per-user and per-request logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# "polling" long-polls getUpdates; "webhook" receives updates on an embedded HTTP server
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public HTTPS URL Telegram posts updates to, e.g. https://bot.example.com/telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Compared with the X-Telegram-Bot-Api-Secret-Token header
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))  # Max updates being handled at the same time
+UNLIMITED_UPDATES = 2**31 - 1  # PTB's semaphore bound; PerChatUpdateProcessor applies UPDATE_CONCURRENCY itself
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Handles up to `max_concurrent_updates` updates at once, but a chat's updates one at a time and in order,
+    so the role conversations never see two messages from the same chat interleave.
+    An update waits for its chat's lock before taking one of the slots, so a chatty chat's queued updates
+    never hold slots other chats could use. PTB's own limit is set out of the way for this.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(UNLIMITED_UPDATES)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> [lock, updates holding or waiting for it]
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+async def on_startup(app: Application):
+    """Applies schema migrations, warms the profile cache, starts the outbound message dispatcher and the alert jobs."""
+    await run_db(apply_migrations)
+
+    try:
+        profile_cache.warm(await run_db(load_all_profiles))
+    except Exception as e:
+        logging.error(f"❌ Error warming the profile cache, falling back to DB lookups: {e}", exc_info=True)
+
+    dispatcher = MessageDispatcher(
+        app.bot, on_delivered=record_delivered_messages, on_dropped=record_dropped_messages, sender_id=SENDER_ID
+    )
+    await dispatcher.start()
+    app.bot_data["dispatcher"] = dispatcher
+
+    # Scheduled once the cache is warm, so the first alert cycle isn't pushed back by startup work
+    if ALERT_RUNNER == "workers":
+        logging.info("👷 Job alerts are run by bot.worker processes")
+    else:
+        start_user_scheduler(app.job_queue)
+
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = await start_metrics_server(METRICS_PORT)
+
+async def on_shutdown(app: Application):
+    """Drains the dispatcher and releases the shared HTTP client and database connections."""
+    await app.bot_data["dispatcher"].stop()
+    await close_async_client()
+    db_pool.close()
+    if "metrics_server" in app.bot_data:
+        app.bot_data["metrics_server"].close()
 
 def run_bot():
+    mark_startup()
     logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
-    level=logging.INFO,  # Change to DEBUG for more details
+    level=LOG_LEVEL,  # LOG_LEVEL=DEBUG for more details
     handlers=[
         logging.FileHandler("logs/bot.log"),  # Save logs to bot.log
         logging.StreamHandler()  # Print logs to console
     ]
     )
-    app = Application.builder().token(BOT_TOKEN).build()
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # One INFO line per HTTP request otherwise
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_BASE_URL)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY))
+        .build()
+    )
     
-    # Register handlers
+    # Register handlers; the alert loop is scheduled on the bot's own event loop by on_startup
     register_handlers(app)
-    start_user_scheduler()
+    start_retention_job(app.job_queue)
+    start_digest_job(app.job_queue)
 
-    logging.info("🚀 Bot is starting...")
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise SystemExit("❌ BOT_MODE=webhook needs WEBHOOK_URL")
+        logging.info(f"🚀 Bot is starting with a webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}...")
+        # Telegram posts each update straight to us; needs python-telegram-bot[webhooks]
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urlparse(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=min(UPDATE_CONCURRENCY, 100),  # Telegram allows 1-100
+        )
+    else:
+        logging.info("🚀 Bot is starting...")
+        app.run_polling()
 
 if __name__ == "__main__":
     run_bot()
@@ -0,0 +1,238 @@
+import os
+import hashlib
+from psycopg2.extras import execute_values
+
+JOB_FIELDS = ("link", "title", "company", "location", "duration", "post_date")
+
+# Adaptive polling: a keyword's interval doubles after every crawl without new links and drops back
+# to the floor as soon as one shows up
+KEYWORD_POLL_MIN = float(os.getenv("KEYWORD_POLL_MIN", os.getenv("ALERT_INTERVAL", "60")))
+KEYWORD_POLL_MAX = float(os.getenv("KEYWORD_POLL_MAX", "900"))
+KEYWORD_POLL_BACKOFF = float(os.getenv("KEYWORD_POLL_BACKOFF", "2"))
+
+# A posting found by a keyword for the first time is only alerted if the catalog first stored it this recently,
+# so keywords that reach old rows (a lost high-water mark, a new source) don't resend them
+NEW_POSTING_WINDOW = float(os.getenv("NEW_POSTING_WINDOW", "86400"))
+
+# Sent history retention: each user's newest SENT_HISTORY_LIMIT entries are kept
+SENT_HISTORY_LIMIT = int(os.getenv("SENT_HISTORY_LIMIT", "30"))
+
+# Never-crawled keywords are always due; half a floor of slack so a keyword isn't missed by a tick that fires early
+DUE_KEYWORD = """(
+    k.last_scraped_at IS NULL
+    OR k.last_scraped_at + make_interval(secs => COALESCE(k.poll_interval, %(floor)s) - %(floor)s / 2) <= NOW()
+)"""
+
+def load_role_keywords(cursor, due_only=True):
+    """Returns {role: high_water_link} for every followed role, or only the ones due for a crawl."""
+    cursor.execute(f"""
+        SELECT r.role, k.high_water_link
+        FROM (SELECT DISTINCT unnest(roles) AS role FROM users) r
+        LEFT JOIN keywords k ON k.keyword = r.role
+        WHERE {DUE_KEYWORD if due_only else "TRUE"}
+    """, {"floor": KEYWORD_POLL_MIN})
+    return dict(cursor.fetchall())
+
+def load_high_water_links(cursor, keywords):
+    """Returns {keyword: high_water_link} for the given keywords that are due, None for keywords never crawled."""
+    cursor.execute(f"""
+        SELECT c.keyword, k.high_water_link
+        FROM unnest(%(keywords)s::text[]) AS c(keyword)
+        LEFT JOIN keywords k ON k.keyword = c.keyword
+        WHERE {DUE_KEYWORD}
+    """, {"keywords": list(keywords), "floor": KEYWORD_POLL_MIN})
+    return dict(cursor.fetchall())
+
+def ingest_jobs(cursor, crawl_results, matches=None, roles_by_key=None):
+    """
+    Adds crawled jobs to the global catalog and returns the postings that are new for at least one keyword:
+    a list of (job, keywords). A posting is new for a keyword the first time that keyword finds it (see the
+    job_keywords table), so a posting first found by another shard, worker or source is still routed to this
+    keyword's subscribers. Postings first stored more than NEW_POSTING_WINDOW seconds ago are never new again.
+    `crawl_results` is {keyword: (jobs, high_water_link)}; high-water marks are saved in the same transaction.
+    `matches` is {role: jobs} when roles were matched locally against the crawled listing instead of searched.
+    `roles_by_key` maps crawl state keys that aren't the role itself (other job sources, see scraper.sources)
+    back to the searched role, so every source's results for a role are routed under that role.
+    Jobs only found by a keyword's very first crawl are recorded as a baseline and not returned.
+    """
+    if not crawl_results:
+        return []
+
+    cold_keywords = update_keyword_stats(cursor, crawl_results)
+
+    # (link, keyword) pairs, and whether each pair was only seen by a baseline crawl
+    baseline_by_pair = {}
+    if matches is None:
+        roles_by_key = roles_by_key or {}
+        for key, (jobs, _) in crawl_results.items():
+            for job in jobs:
+                pair = (job.link, roles_by_key.get(key, key))
+                baseline_by_pair[pair] = baseline_by_pair.get(pair, True) and key in cold_keywords
+    else:
+        baseline = bool(cold_keywords)  # Every role was matched against the listing's baseline crawl
+        for keyword, jobs in matches.items():
+            for job in jobs:
+                baseline_by_pair[(job.link, keyword)] = baseline
+
+    jobs_by_link = {}
+    for jobs, _ in crawl_results.values():
+        for job in jobs:
+            jobs_by_link.setdefault(job.link, job)
+
+    if not jobs_by_link:
+        return []
+
+    # Every crawled job goes into the catalog once...
+    execute_values(
+        cursor,
+        f"INSERT INTO jobs ({', '.join(JOB_FIELDS)}) VALUES %s ON CONFLICT (link) DO NOTHING",
+        [tuple(getattr(job, field) for field in JOB_FIELDS) for job in jobs_by_link.values()],
+        page_size=len(jobs_by_link)
+    )
+    if not baseline_by_pair:
+        return []
+
+    # ...and once per keyword that found it; only pairs inserted now are new
+    cursor.execute("""
+        WITH pairs AS (
+            SELECT j.job_id, j.link, j.first_seen_at, c.keyword
+            FROM unnest(%(links)s::text[], %(keywords)s::text[]) AS c(link, keyword)
+            JOIN jobs j ON j.link = c.link
+        ), inserted AS (
+            INSERT INTO job_keywords (job_id, keyword)
+            SELECT job_id, keyword FROM pairs
+            ON CONFLICT DO NOTHING
+            RETURNING job_id, keyword
+        )
+        SELECT p.link, p.keyword
+        FROM inserted i
+        JOIN pairs p ON p.job_id = i.job_id AND p.keyword = i.keyword
+        WHERE p.first_seen_at >= LOCALTIMESTAMP - make_interval(secs => %(window)s)
+    """, {
+        "links": [link for link, _ in baseline_by_pair],
+        "keywords": [keyword for _, keyword in baseline_by_pair],
+        "window": NEW_POSTING_WINDOW,
+    })
+
+    keywords_by_link = {}
+    for link, keyword in cursor.fetchall():
+        if not baseline_by_pair[(link, keyword)]:
+            keywords_by_link.setdefault(link, []).append(keyword)
+    return [(jobs_by_link[link], keywords) for link, keywords in keywords_by_link.items()]
+
+def update_keyword_stats(cursor, crawl_results):
+    """
+    Saves each crawled keyword's high-water mark and adapts its poll interval to whether the crawl found new links.
+    Returns the keywords crawled for the first time, whose results are only a baseline.
+    """
+    params = {
+        "keywords": list(crawl_results),
+        "links": [high_water_link for _, high_water_link in crawl_results.values()],
+        "counts": [len(jobs) for jobs, _ in crawl_results.values()],
+        "floor": KEYWORD_POLL_MIN,
+        "ceiling": KEYWORD_POLL_MAX,
+        "backoff": KEYWORD_POLL_BACKOFF,
+    }
+    cursor.execute("""
+        INSERT INTO keywords (keyword, high_water_link, last_scraped_at, poll_interval, polls)
+        SELECT keyword, high_water_link, NOW(), %(floor)s, 1
+        FROM unnest(%(keywords)s::text[], %(links)s::text[]) AS c(keyword, high_water_link)
+        ON CONFLICT (keyword) DO NOTHING
+        RETURNING keyword
+    """, params)
+    cold_keywords = {row[0] for row in cursor.fetchall()}
+
+    cursor.execute("""
+        UPDATE keywords k
+        SET high_water_link = c.high_water_link,
+            last_scraped_at = NOW(),
+            poll_interval = CASE
+                WHEN c.new_count > 0 THEN %(floor)s
+                ELSE LEAST(%(ceiling)s, COALESCE(k.poll_interval, %(floor)s) * %(backoff)s)
+            END,
+            polls = k.polls + 1,
+            new_jobs = k.new_jobs + c.new_count,
+            last_new_at = CASE WHEN c.new_count > 0 THEN NOW() ELSE k.last_new_at END
+        FROM unnest(%(keywords)s::text[], %(links)s::text[], %(counts)s::int[]) AS c(keyword, high_water_link, new_count)
+        WHERE k.keyword = c.keyword
+        AND NOT k.keyword = ANY(%(cold)s::text[])
+    """, {**params, "cold": list(cold_keywords)})
+    return cold_keywords
+
+def route_new_jobs(cursor, new_jobs):
+    """Maps new (job, keywords) pairs to {chat_id: [jobs]} using the GIN index on users.roles."""
+    if not new_jobs:
+        return {}
+
+    jobs_by_keyword = {}
+    for job, keywords in new_jobs:
+        for keyword in keywords:
+            jobs_by_keyword.setdefault(keyword, []).append(job)
+
+    cursor.execute("SELECT chat_id, roles FROM users WHERE roles && %s::text[]", (list(jobs_by_keyword),))
+
+    jobs_by_user = {}
+    for chat_id, roles in cursor.fetchall():
+        user_jobs = {}
+        for role in roles:
+            for job in jobs_by_keyword.get(role, []):
+                user_jobs.setdefault(job.link, job)
+        jobs_by_user[chat_id] = list(user_jobs.values())
+    return jobs_by_user
+
+def link_hash(link):
+    """
+    64-bit key stored in users_jobs_sent instead of the full URL: the first 8 bytes of the link's MD5,
+    as a signed big-endian integer. Postgres computes the same value with ('x' || substr(md5(link), 1, 16))::bit(64)::bigint.
+    """
+    return int.from_bytes(hashlib.md5(link.encode("utf-8")).digest()[:8], "big", signed=True)
+
+def find_unseen_links(cursor, chat_id, links):
+    """Returns the links from `links` that haven't been sent to the user yet, in one round trip."""
+    if not links:
+        return []
+    cursor.execute("""
+        SELECT c.link
+        FROM unnest(%(links)s::text[], %(hashes)s::bigint[]) AS c(link, link_hash)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM users_jobs_sent s
+            WHERE s.chat_id = %(chat_id)s AND s.link_hash = c.link_hash
+        )
+    """, {"chat_id": chat_id, "links": links, "hashes": [link_hash(link) for link in links]})
+    return [row[0] for row in cursor.fetchall()]
+
+def record_sent_jobs(cursor, sent_jobs):
+    """Marks (chat_id, job_link) pairs as sent with one multi-row insert. Old entries are pruned by prune_sent_history."""
+    if not sent_jobs:
+        return
+    execute_values(
+        cursor,
+        "INSERT INTO users_jobs_sent (chat_id, link_hash, sent_at) VALUES %s ON CONFLICT DO NOTHING",
+        [(chat_id, link_hash(link)) for chat_id, link in sent_jobs],
+        template="(%s, %s, NOW())",
+        page_size=len(sent_jobs)
+    )
+
+def prune_sent_history(cursor, after_chat_id, batch_size, keep=SENT_HISTORY_LIMIT):
+    """
+    Deletes all but the newest `keep` sent entries of the next `batch_size` users after `after_chat_id`.
+    Only the batch's users are read, through the (chat_id, sent_at) index, so each transaction stays short.
+    Returns (last chat_id in the batch or None when past the last user, rows deleted).
+    """
+    cursor.execute("""
+        WITH batch AS (
+            SELECT chat_id FROM users WHERE chat_id > %(after)s ORDER BY chat_id LIMIT %(batch_size)s
+        ), deleted AS (
+            DELETE FROM users_jobs_sent s
+            USING batch b, LATERAL (
+                SELECT link_hash FROM users_jobs_sent
+                WHERE chat_id = b.chat_id
+                ORDER BY sent_at DESC
+                OFFSET %(keep)s
+            ) old
+            WHERE s.chat_id = b.chat_id AND s.link_hash = old.link_hash
+            RETURNING 1
+        )
+        SELECT (SELECT MAX(chat_id) FROM batch), (SELECT COUNT(*) FROM deleted)
+    """, {"after": after_chat_id, "batch_size": batch_size, "keep": keep})
+    return cursor.fetchone()
@@ -1,6 +1,13 @@
 import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool
 from dotenv import load_dotenv
+from metrics import gauge, histogram, timed
 
 # Load environment variables
 load_dotenv()
@@ -11,37 +18,157 @@ DB_PASS = os.getenv("DB_PASS")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
-# Connect to PostgreSQL
-def connect_db():
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-# Initialize Database (Run once to ensure table exists)
-def init_db():
-    conn = connect_db()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            chat_id BIGINT PRIMARY KEY,
-            roles TEXT[]
-        );
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users_jobs_sent (
-            chat_id BIGINT NOT NULL,
-            job_link TEXT NOT NULL,
-            sent_at TIMESTAMP DEFAULT NOW(),
-            PRIMARY KEY (chat_id, job_link)
-        );
-    """)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-
-init_db()  # Call this once at the start
+# Connection pool limits
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # Seconds to wait for a free connection
+DB_HEALTHCHECK_IDLE = float(os.getenv("DB_HEALTHCHECK_IDLE", "30"))  # Ping connections idle longer than this
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+class DatabasePool:
+    """Bounded, thread-safe psycopg2 pool with health checks and acquire/wait statistics."""
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_idle=DB_HEALTHCHECK_IDLE):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._pool = None
+        self.cursor_factory = None  # Set before first use to instrument every cursor (see benchmarks/)
+        self._lock = threading.Lock()
+        # ThreadedConnectionPool raises instead of waiting when exhausted, so callers queue here
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+        self.acquired = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn,
+                        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT,
+                        cursor_factory=self.cursor_factory
+                    )
+                    # psycopg2 closes released connections beyond minconn; keep them all open for reuse
+                    self._pool.minconn = self.maxconn
+        return self._pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        """Checks out a healthy connection, waiting up to `timeout` seconds for a free slot."""
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.timeouts += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+        try:
+            db_pool = self._get_pool()
+            conn = db_pool.getconn()
+            if not self._is_healthy(conn):
+                logging.warning("⚠️ Discarding broken database connection")
+                self._discard(db_pool, conn)
+                conn = db_pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        wait = time.monotonic() - start
+        self.acquired += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        return conn
+
+    def release(self, conn, discard=False):
+        """Returns a connection to the pool, closing it instead if it is broken."""
+        db_pool = self._get_pool()
+        try:
+            if discard or conn.closed:
+                self._discard(db_pool, conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                db_pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, db_pool, conn):
+        self.discarded += 1
+        self._last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """Yields a pooled connection; commits on success and rolls back on error."""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) or conn.closed
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    def stats(self):
+        """Returns acquire/wait counters for logging and metrics."""
+        return {
+            "max_size": self.maxconn,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "discarded": self.discarded,
+            "wait_avg_ms": (self.wait_total / self.acquired * 1000) if self.acquired else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+            self._last_used.clear()
+
+db_pool = DatabasePool()
+
+DB_QUERY_SECONDS = histogram("db_query_seconds", "run_db call time including the pool wait, by query")
+gauge("db_pool_wait_avg_seconds", "Average wait for a pooled connection", lambda: db_pool.stats()["wait_avg_ms"] / 1000)
+gauge("db_pool_wait_max_seconds", "Longest wait for a pooled connection", lambda: db_pool.stats()["wait_max_ms"] / 1000)
+gauge("db_pool_timeouts", "Connection requests that gave up after DB_POOL_TIMEOUT", lambda: db_pool.timeouts)
+
+@contextmanager
+def db_cursor():
+    """Shared pooled cursor: `with db_cursor() as cursor: ...` commits when the block succeeds."""
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            yield cursor
+
+def _run_with_cursor(func, *args):
+    with timed(DB_QUERY_SECONDS, query=func.__name__):
+        with db_cursor() as cursor:
+            return func(cursor, *args)
+
+async def run_db(func, *args):
+    """Runs func(cursor, *args) on a worker thread so DB calls don't block the event loop."""
+    return await asyncio.to_thread(_run_with_cursor, func, *args)
@@ -0,0 +1,206 @@
+"""
+Digest mode: instead of one message per job, a user's new matches are packed into as few messages as fit.
+
+Every digest mode buffers matches in the digest_queue table (one row per user and job, so a job matching several
+roles, sources or shards is listed once). "immediate" digests are flushed after each round of alert shards, so a
+user gets one digest per round however many batches found their jobs. "hourly" and "daily" digests wait until the
+user's oldest buffered job is that old; the flush job then sends them through the dispatcher.
+"""
+import os
+from psycopg2.extras import execute_values
+from bot.catalog import JOB_FIELDS, link_hash, record_sent_jobs
+from bot.outbox import clear_alerts
+from scraper.parsers import JobRecord
+
+# "off" sends one message per job, as before digests existed
+DIGEST_MODES = ("off", "immediate", "hourly", "daily")
+DIGEST_CADENCES = {"hourly": 3600, "daily": 86400}  # Seconds a buffered job may wait, per scheduled mode
+
+DIGEST_FLUSH_INTERVAL = float(os.getenv("DIGEST_FLUSH_INTERVAL", "300"))  # Seconds between checks for due digests
+DIGEST_FLUSH_BATCH = int(os.getenv("DIGEST_FLUSH_BATCH", "500"))  # Users claimed per transaction
+DIGEST_RECLAIM_AFTER = float(os.getenv("DIGEST_RECLAIM_AFTER", "900"))  # Claimed but unconfirmed jobs are retried after this
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+DIGEST_TITLE_LIMIT = 200  # Keeps every entry far below the message limit
+
+# --- Packing ---
+def format_digest_entry(job):
+    title = job.title if len(job.title) <= DIGEST_TITLE_LIMIT else job.title[:DIGEST_TITLE_LIMIT - 1] + "…"
+    return f"🔹 {title} at {job.company}\n📍 {job.location} · 🕒 {job.duration} · 📅 {job.post_date}\n🔗 {job.link}"
+
+def pack_digest(jobs, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Packs jobs into as few messages of at most `limit` characters as possible, each job once.
+    Returns a list of (text, job_links).
+    """
+    jobs = list({job.link: job for job in jobs}.values())
+    header_room = len(f"📰 Job digest: {len(jobs)} new jobs (99/99)\n\n")
+
+    chunks, entries, links, size = [], [], [], header_room
+    for job in jobs:
+        entry = format_digest_entry(job)
+        if entries and size + 2 + len(entry) > limit:
+            chunks.append((entries, links))
+            entries, links, size = [], [], header_room
+        entries.append(entry)
+        links.append(job.link)
+        size += 2 + len(entry)
+    if entries:
+        chunks.append((entries, links))
+
+    messages = []
+    for index, (entries, links) in enumerate(chunks, 1):
+        part = f" ({index}/{len(chunks)})" if len(chunks) > 1 else ""
+        header = f"📰 Job digest: {len(jobs)} new job{'s' if len(jobs) != 1 else ''}{part}"
+        messages.append(("\n\n".join([header] + entries), links))
+    return messages
+
+# --- Database Helpers ---
+def load_digest_modes(cursor, chat_ids):
+    """Returns {chat_id: mode} for the given users that have a digest mode other than "off"."""
+    cursor.execute(
+        "SELECT chat_id, digest FROM users WHERE chat_id = ANY(%s::bigint[]) AND digest <> 'off'",
+        (list(chat_ids),)
+    )
+    return dict(cursor.fetchall())
+
+def set_digest_mode(cursor, chat_id, mode):
+    """
+    Returns False if the user isn't subscribed. Switching to "off" moves the user's buffered jobs to the alert
+    outbox, unclaimed, so the next alert cycle sends them one message per job instead of stranding them.
+    """
+    cursor.execute("UPDATE users SET digest = %s WHERE chat_id = %s RETURNING chat_id", (mode, chat_id))
+    if cursor.fetchone() is None:
+        return False
+    if mode == "off":
+        cursor.execute("""
+            WITH moved AS (
+                DELETE FROM digest_queue WHERE chat_id = %s RETURNING chat_id, job_id, queued_at
+            )
+            INSERT INTO alert_outbox (chat_id, job_id, queued_at)
+            SELECT m.chat_id, m.job_id, m.queued_at
+            FROM moved m
+            JOIN jobs j ON j.job_id = m.job_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM users_jobs_sent s
+                WHERE s.chat_id = m.chat_id AND s.link_hash = ('x' || substr(md5(j.link), 1, 16))::bit(64)::bigint
+            )
+            ON CONFLICT DO NOTHING
+        """, (chat_id,))
+    return True
+
+def fetch_digest_mode(cursor, chat_id):
+    """Returns the user's digest mode, or None if the user isn't subscribed."""
+    cursor.execute("SELECT digest FROM users WHERE chat_id = %s", (chat_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def queue_digest_jobs(cursor, queued_jobs):
+    """Buffers (chat_id, job_link) pairs; a job already buffered for the user keeps its original queued_at."""
+    if not queued_jobs:
+        return
+    execute_values(
+        cursor,
+        """
+        INSERT INTO digest_queue (chat_id, job_id)
+        SELECT c.chat_id, j.job_id
+        FROM (VALUES %s) AS c(chat_id, link)
+        JOIN jobs j ON j.link = c.link
+        ON CONFLICT DO NOTHING
+        """,
+        queued_jobs,
+        template="(%s::bigint, %s)",
+        page_size=len(queued_jobs)
+    )
+
+def claim_due_digests(cursor, cadences=None, batch_size=DIGEST_FLUSH_BATCH, reclaim_after=DIGEST_RECLAIM_AFTER):
+    """
+    Claims the buffered jobs of up to `batch_size` users whose digest is due and returns {chat_id: [JobRecord]}.
+    `cadences` maps the modes to flush to the seconds their oldest job must have waited; by default the scheduled
+    modes, plus "immediate" jobs a whole flush interval old, in case the end-of-round flush didn't run.
+    Claimed jobs are skipped by later calls until they are confirmed delivered (record_delivered_jobs) or the claim
+    is `reclaim_after` seconds old. Buffered jobs the user has already been sent are dropped.
+    """
+    if cadences is None:
+        cadences = {**DIGEST_CADENCES, "immediate": DIGEST_FLUSH_INTERVAL}
+    cursor.execute(f"""
+        WITH due AS (
+            SELECT q.chat_id
+            FROM digest_queue q
+            JOIN users u ON u.chat_id = q.chat_id
+            JOIN unnest(%(modes)s::text[], %(cadences)s::float8[]) AS c(mode, cadence) ON c.mode = u.digest
+            WHERE q.claimed_at IS NULL OR q.claimed_at < NOW() - make_interval(secs => %(reclaim)s)
+            GROUP BY q.chat_id, c.cadence
+            HAVING MIN(q.queued_at) <= NOW() - make_interval(secs => c.cadence)
+            ORDER BY q.chat_id
+            LIMIT %(batch_size)s
+        )
+        UPDATE digest_queue q
+        SET claimed_at = NOW()
+        FROM due, jobs j
+        WHERE q.chat_id = due.chat_id AND j.job_id = q.job_id
+        AND (q.claimed_at IS NULL OR q.claimed_at < NOW() - make_interval(secs => %(reclaim)s))
+        RETURNING q.chat_id, q.job_id, {', '.join(f"j.{field}" for field in JOB_FIELDS)}
+    """, {
+        "modes": list(cadences),
+        "cadences": list(cadences.values()),
+        "reclaim": reclaim_after,
+        "batch_size": batch_size,
+    })
+    rows = cursor.fetchall()
+    if not rows:
+        return {}
+
+    # Drop jobs that reached the user another way, e.g. before they switched to a digest
+    cursor.execute("""
+        DELETE FROM digest_queue q
+        USING unnest(%(chat_ids)s::bigint[], %(job_ids)s::bigint[], %(hashes)s::bigint[]) AS c(chat_id, job_id, link_hash)
+        WHERE q.chat_id = c.chat_id AND q.job_id = c.job_id
+        AND EXISTS (SELECT 1 FROM users_jobs_sent s WHERE s.chat_id = c.chat_id AND s.link_hash = c.link_hash)
+        RETURNING q.chat_id, q.job_id
+    """, {
+        "chat_ids": [row[0] for row in rows],
+        "job_ids": [row[1] for row in rows],
+        "hashes": [link_hash(row[2]) for row in rows],
+    })
+    already_sent = set(cursor.fetchall())
+
+    digests = {}
+    for chat_id, job_id, *fields in rows:
+        if (chat_id, job_id) not in already_sent:
+            digests.setdefault(chat_id, []).append(JobRecord(*_job_fields(fields)))
+    return digests
+
+def _job_fields(fields):
+    """JOB_FIELDS order (link first) to JobRecord order (link last)."""
+    values = dict(zip(JOB_FIELDS, fields))
+    return [values[field] for field in JobRecord._fields]
+
+def record_delivered_jobs(cursor, sent_jobs):
+    """record_sent_jobs, plus removing the delivered jobs from the users' digest queues and the alert outbox."""
+    if not sent_jobs:
+        return
+    record_sent_jobs(cursor, sent_jobs)
+    clear_alerts(cursor, sent_jobs)
+    clear_digest_jobs(cursor, sent_jobs)
+
+def clear_digest_jobs(cursor, jobs):
+    """Deletes buffered (chat_id, job_link) pairs that were delivered, or whose digest Telegram rejected for good."""
+    if not jobs:
+        return
+    cursor.execute("""
+        DELETE FROM digest_queue q
+        USING unnest(%s::bigint[], %s::text[]) AS c(chat_id, link), jobs j
+        WHERE j.link = c.link AND q.chat_id = c.chat_id AND q.job_id = j.job_id
+    """, ([chat_id for chat_id, _ in jobs], [link for _, link in jobs]))
+
+def release_digest_jobs(cursor, jobs):
+    """Unclaims buffered jobs whose digest send was given up, so the next flush tries them again."""
+    if not jobs:
+        return
+    cursor.execute("""
+        UPDATE digest_queue q
+        SET claimed_at = NULL
+        FROM unnest(%s::bigint[], %s::text[]) AS c(chat_id, link), jobs j
+        WHERE j.link = c.link AND q.chat_id = c.chat_id AND q.job_id = j.job_id
+    """, ([chat_id for chat_id, _ in jobs], [link for _, link in jobs]))
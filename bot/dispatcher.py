@@ -0,0 +1,342 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from bot.config import run_db
+from metrics import counter, gauge, histogram, timed
+
+# Telegram allows roughly 30 messages/s per bot and 1 message/s per chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1"))
+DISPATCHER_WORKERS = int(os.getenv("DISPATCHER_WORKERS", "8"))
+DISPATCHER_MAX_RETRIES = int(os.getenv("DISPATCHER_MAX_RETRIES", "5"))
+DISPATCHER_FLUSH_INTERVAL = float(os.getenv("DISPATCHER_FLUSH_INTERVAL", "1"))
+# Processes sending with the same bot token (the bot and each worker) split TELEGRAM_GLOBAL_RATE evenly;
+# each one re-counts the active senders in Postgres this often
+TELEGRAM_RATE_SHARE_INTERVAL = float(os.getenv("TELEGRAM_RATE_SHARE_INTERVAL", "10"))
+
+SEND_SECONDS = histogram("telegram_send_seconds", "Telegram sendMessage latency")
+SEND_RESULTS = counter("telegram_messages_total", "Send attempts by result: sent, retry_after, network_error or dropped")
+QUEUE_DEPTH = gauge("telegram_queue_depth", "Messages waiting in the dispatcher queue")
+SEND_RATE = gauge("telegram_send_rate_limit", "This process's share of TELEGRAM_GLOBAL_RATE, in messages/s")
+
+# --- Rate sharing (telegram_senders table) ---
+def heartbeat_sender(cursor, sender_id, ttl):
+    """Marks `sender_id` as active and returns how many senders were active within the last `ttl` seconds."""
+    cursor.execute("""
+        INSERT INTO telegram_senders (sender_id, seen_at) VALUES (%s, NOW())
+        ON CONFLICT (sender_id) DO UPDATE SET seen_at = NOW()
+    """, (sender_id,))
+    cursor.execute("DELETE FROM telegram_senders WHERE seen_at < NOW() - make_interval(secs => %s)", (ttl,))
+    cursor.execute("SELECT COUNT(*) FROM telegram_senders")
+    return cursor.fetchone()[0]
+
+def remove_sender(cursor, sender_id):
+    cursor.execute("DELETE FROM telegram_senders WHERE sender_id = %s", (sender_id,))
+
+class TokenBucket:
+    """Async token bucket: acquire() waits until a token is available."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def set_rate(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self._tokens = min(self._tokens, self.capacity)
+
+class OutgoingMessage:
+    """A queued Telegram message and the job links it delivers."""
+    __slots__ = ("chat_id", "text", "job_links", "attempts", "rejected")
+
+    def __init__(self, chat_id, text, job_links=()):
+        self.chat_id = chat_id
+        self.text = text
+        self.job_links = tuple(job_links)
+        self.attempts = 0
+        self.rejected = False  # Telegram refused it for good (Forbidden or BadRequest), retrying won't help
+
+class MessageDispatcher:
+    """
+    Outbound message queue with a global token bucket and per-chat pacing.
+    Workers honour RetryAfter, retry network errors with exponential backoff, and report
+    delivered messages to `on_delivered` in batches so the caller only marks confirmed sends.
+    Messages given up on or rejected by Telegram are reported to `on_dropped` the same way.
+    With a `sender_id`, the global rate is shared with the other processes sending for the same bot.
+    """
+
+    def __init__(self, bot, on_delivered=None, on_dropped=None, workers=DISPATCHER_WORKERS, global_rate=TELEGRAM_GLOBAL_RATE,
+                 chat_interval=TELEGRAM_CHAT_INTERVAL, max_retries=DISPATCHER_MAX_RETRIES,
+                 flush_interval=DISPATCHER_FLUSH_INTERVAL, sender_id=None,
+                 rate_share_interval=TELEGRAM_RATE_SHARE_INTERVAL):
+        self.bot = bot
+        self.on_delivered = on_delivered
+        self.on_dropped = on_dropped
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.flush_interval = flush_interval
+        self.global_rate = global_rate
+        self.sender_id = sender_id
+        self.rate_share_interval = rate_share_interval
+
+        self._queue = asyncio.Queue()
+        self._bucket = TokenBucket(global_rate)
+        self._chat_next_slot = {}
+        self._chat_last_sent = {}
+        self._paused_until = 0.0  # Set by RetryAfter, which Telegram applies to the whole bot
+        self._pending = set()  # (chat_id, job_link) queued or in flight
+        self._delivered = []
+        self._dropped = []
+        self._tasks = []
+        self._held = {}  # chat_id -> messages waiting for the chat's next slot, in order
+        self._sending = set()  # Chats with a message being delivered; their next message waits for it
+        self._hold_tasks = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.retry_after_waits = 0
+        self._sent_times = deque()
+
+    # --- Lifecycle ---
+    async def start(self):
+        if self._tasks:
+            return
+        QUEUE_DEPTH.func = self._queue.qsize
+        SEND_RATE.set(self._bucket.rate)
+        if self.sender_id is not None:
+            await self.share_rate()  # Before the first send, so a new process never exceeds its share
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        if self.sender_id is not None:
+            self._tasks.append(asyncio.create_task(self._share_rate_loop()))
+        logging.info(f"📬 Message dispatcher started with {self.workers} workers")
+
+    async def stop(self, drain=True):
+        """Stops the workers, optionally after the queue has been drained, and flushes confirmations."""
+        if drain:
+            await self._queue.join()
+        tasks = self._tasks + list(self._hold_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._held.clear()
+        self._sending.clear()
+        await self.flush()
+        if self.sender_id is not None:
+            try:
+                await run_db(remove_sender, self.sender_id)  # The others take over its share straight away
+            except Exception as e:
+                logging.error(f"❌ Error unregistering sender {self.sender_id}: {e}", exc_info=True)
+
+    # --- Rate sharing ---
+    async def share_rate(self):
+        """Re-counts the active senders and takes an equal share of the global rate."""
+        try:
+            senders = await run_db(heartbeat_sender, self.sender_id, self.rate_share_interval * 3)
+        except Exception as e:
+            logging.error(f"❌ Error counting Telegram senders, keeping {self._bucket.rate:g} msg/s: {e}", exc_info=True)
+            return
+        rate = self.global_rate / max(1, senders)
+        if rate != self._bucket.rate:
+            self._bucket.set_rate(rate)
+            SEND_RATE.set(rate)
+            logging.info(f"📬 {senders} processes share the Telegram rate, sending up to {rate:g} msg/s")
+
+    async def _share_rate_loop(self):
+        while True:
+            await asyncio.sleep(self.rate_share_interval)
+            await self.share_rate()
+
+    # --- Producer API ---
+    def enqueue(self, chat_id, text, job_links=()):
+        """Queues a message. Returns False if every job link in it is already queued for this chat."""
+        keys = {(chat_id, link) for link in job_links}
+        if keys and keys <= self._pending:
+            return False
+        self._pending |= keys
+        self._queue.put_nowait(OutgoingMessage(chat_id, text, job_links))
+        return True
+
+    def is_pending(self, chat_id, job_link):
+        return (chat_id, job_link) in self._pending
+
+    # --- Workers ---
+    async def _worker(self):
+        while True:
+            message = await self._queue.get()
+            chat_id = message.chat_id
+            delay = self._chat_next_slot.get(chat_id, 0.0) - time.monotonic()
+            if delay > 0 or chat_id in self._held or chat_id in self._sending:
+                # Don't tie a worker up waiting on one busy chat; other chats are served meanwhile
+                self._hold(message, delay)
+                continue
+
+            # One message per chat at a time, so retries and RetryAfter pauses can't reorder a chat's messages
+            self._sending.add(chat_id)
+            delivered = False
+            try:
+                delivered = await self._deliver(message)
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"❌ Unexpected error delivering to {chat_id}: {e}", exc_info=True)
+            finally:
+                self._sending.discard(chat_id)
+                if chat_id in self._held:
+                    self._schedule_requeue(chat_id, self._chat_next_slot.get(chat_id, 0.0) - time.monotonic())
+                # Delivered messages stay pending until their confirmation has been flushed
+                if not delivered:
+                    self._release(message)
+                    self._dropped.append(message)
+                self._queue.task_done()
+
+    def _hold(self, message, delay):
+        held = self._held.get(message.chat_id)
+        if held is None:
+            held = self._held[message.chat_id] = []
+            if message.chat_id not in self._sending:  # Otherwise requeued once the delivery in flight ends
+                self._schedule_requeue(message.chat_id, delay)
+        held.append(message)
+
+    def _schedule_requeue(self, chat_id, delay):
+        task = asyncio.create_task(self._requeue_held(chat_id, delay))
+        self._hold_tasks.add(task)
+        task.add_done_callback(self._hold_tasks.discard)
+
+    async def _requeue_held(self, chat_id, delay):
+        """Puts a chat's held messages back on the queue, in order, once its slot is due."""
+        await asyncio.sleep(max(0.0, delay))
+        held = self._held.pop(chat_id, [])
+        for message in held:
+            self._queue.put_nowait(message)
+        for _ in held:
+            self._queue.task_done()  # Only after the re-put, so join() keeps waiting for them
+
+    def _release(self, message):
+        self._pending.difference_update((message.chat_id, link) for link in message.job_links)
+
+    async def _wait_for_slot(self, chat_id):
+        while True:
+            # Reserve this chat's next slot before sleeping so concurrent workers queue up behind it
+            now = time.monotonic()
+            slot = max(now, self._chat_next_slot.get(chat_id, 0.0))
+            self._chat_next_slot[chat_id] = slot + self.chat_interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+            if self._paused_until > time.monotonic():
+                await asyncio.sleep(self._paused_until - time.monotonic())
+            await self._bucket.acquire()
+
+            # The global bucket may have delayed us past another send to the same chat
+            now = time.monotonic()
+            if now - self._chat_last_sent.get(chat_id, float("-inf")) >= self.chat_interval:
+                self._chat_last_sent[chat_id] = now
+                return
+
+    async def _deliver(self, message):
+        while True:
+            await self._wait_for_slot(message.chat_id)
+            message.attempts += 1
+            try:
+                with timed(SEND_SECONDS):
+                    await self.bot.send_message(chat_id=message.chat_id, text=message.text)
+            except RetryAfter as e:
+                SEND_RESULTS.inc(result="retry_after")
+                self.retry_after_waits += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logging.warning(f"⏳ Flood control hit, pausing sends for {e.retry_after}s")
+                continue  # RetryAfter doesn't count against max_retries
+            except (Forbidden, BadRequest) as e:
+                SEND_RESULTS.inc(result="dropped")
+                self.failed += 1
+                message.rejected = True
+                logging.warning(f"⚠️ Dropping message to {message.chat_id}: {e}")
+                return False
+            except NetworkError as e:
+                SEND_RESULTS.inc(result="network_error")
+                if message.attempts > self.max_retries:
+                    self.failed += 1
+                    logging.error(f"❌ Giving up on message to {message.chat_id} after {message.attempts} attempts: {e}")
+                    return False
+                self.retries += 1
+                backoff = min(60, 2 ** (message.attempts - 1))
+                logging.warning(f"⚠️ Send to {message.chat_id} failed ({e}), retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+                continue
+
+            SEND_RESULTS.inc(result="sent")
+            self.sent += 1
+            self._sent_times.append(time.monotonic())
+            self._delivered.append(message)
+            return True
+
+    # --- Delivery confirmations ---
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+            # Forget pacing slots that are already in the past
+            now = time.monotonic()
+            for chat_id in [chat_id for chat_id, slot in self._chat_next_slot.items() if slot < now]:
+                del self._chat_next_slot[chat_id]
+                self._chat_last_sent.pop(chat_id, None)
+
+    async def flush(self):
+        """
+        Hands every delivered message since the last flush to `on_delivered` in one batch, and every dropped one
+        to `on_dropped`.
+        """
+        if self._delivered:
+            batch, self._delivered = self._delivered, []
+            try:
+                if self.on_delivered is not None:
+                    await self.on_delivered(batch)
+                for message in batch:
+                    self._release(message)
+            except Exception as e:
+                self._delivered = batch + self._delivered  # Keep them for the next flush
+                logging.error(f"❌ Error recording {len(batch)} delivered messages: {e}", exc_info=True)
+
+        if self._dropped:
+            batch, self._dropped = self._dropped, []
+            try:
+                if self.on_dropped is not None:
+                    await self.on_dropped(batch)
+            except Exception as e:
+                self._dropped = batch + self._dropped
+                logging.error(f"❌ Error recording {len(batch)} dropped messages: {e}", exc_info=True)
+
+    # --- Metrics ---
+    def stats(self):
+        now = time.monotonic()
+        while self._sent_times and now - self._sent_times[0] > 60:
+            self._sent_times.popleft()
+        return {
+            "queue_depth": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "retry_after_waits": self.retry_after_waits,
+            "sent_per_s_1m": len(self._sent_times) / 60,
+        }
@@ -1,26 +1,134 @@
 import os
-from scraper.scraper import scrape_internsg
-from telegram import Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+import zlib
+from datetime import datetime, timedelta
+from scraper.scraper import crawl_all_listings_async
+from scraper.sources import enabled_sources, stream_source_results
+from scraper.matching import ListingIndex
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    ConversationHandler, CallbackContext, CallbackQueryHandler
+    ConversationHandler, CallbackContext, CallbackQueryHandler, JobQueue
 )
-from apscheduler.schedulers.background import BackgroundScheduler
-import psycopg2
-from bot.config import connect_db
+from bot.config import db_pool, run_db
+from bot.catalog import ingest_jobs, load_high_water_links, load_role_keywords, prune_sent_history, route_new_jobs
+from bot.digest import (
+    DIGEST_FLUSH_INTERVAL, DIGEST_MODES, claim_due_digests, clear_digest_jobs, fetch_digest_mode, load_digest_modes,
+    pack_digest, queue_digest_jobs, record_delivered_jobs, release_digest_jobs, set_digest_mode
+)
+from bot.outbox import claim_undelivered_alerts, clear_alerts, queue_alerts, release_alerts
+from bot.profiles import profile_cache, route_jobs_in_memory
+from metrics import REGISTRY, counter, gauge, histogram, timed
 import logging
 import asyncio
 
-# Load environment variables
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Alert loop settings
+ALERT_INTERVAL = float(os.getenv("ALERT_INTERVAL", "60"))  # Seconds between checks of the same role
+ALERT_SHARDS = int(os.getenv("ALERT_SHARDS", "4"))  # Roles are split into shards whose ticks are spread over the interval
+
+# Sent history retention runs in the background instead of after every send
+SENT_HISTORY_PRUNE_INTERVAL = float(os.getenv("SENT_HISTORY_PRUNE_INTERVAL", "3600"))
+SENT_HISTORY_PRUNE_BATCH = int(os.getenv("SENT_HISTORY_PRUNE_BATCH", "500"))  # Users pruned per transaction
+
+# "search" sends each role to InternSG's site search; "local" crawls the full listing once and matches roles in memory
+SCRAPER_MATCH_MODE = os.getenv("SCRAPER_MATCH_MODE", "search").lower()
+ALL_LISTINGS_KEYWORD = "*"  # keywords row holding the full listing's high-water mark in local mode
+
+# Comma-separated chat IDs allowed to use /stats
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in os.getenv("ADMIN_CHAT_IDS", "").replace(" ", "").split(",") if chat_id}
+
+# Alert loop metrics
+SCHEDULER_LAG_SECONDS = histogram("alert_scheduler_lag_seconds", "How late an alert cycle started after it was due")
+CYCLE_SECONDS = histogram("alert_cycle_seconds", "Duration of one alert cycle (crawl, ingest, route and enqueue)")
+NEW_POSTINGS = counter("alert_new_postings_total", "Postings new to at least one keyword, once per cycle")
+ALERTS_QUEUED = counter("alert_messages_queued_total", "Job alerts handed to the dispatcher")
+DIGEST_JOBS_BUFFERED = counter("alert_digest_jobs_buffered_total", "Jobs buffered for digests")
+TIME_TO_FIRST_POLL = gauge("startup_time_to_first_poll_seconds", "From run_bot/run_worker to the first alert cycle")
 
-bot = Bot(token=BOT_TOKEN)
-scheduler = BackgroundScheduler()  # Create global scheduler instance
-scheduler_started = False
+_startup_began_at = None  # Set by mark_startup(), cleared once the first alert cycle has reported it
 
 # Conversation States
 ROLE_ENTRY, ROLE_DELETE, ROLE_ADD = range(3)
 
+# --- Database Helpers (run on a worker thread through run_db) ---
+def fetch_user_roles(cursor, chat_id):
+    """Returns the user's roles, or None if the user isn't subscribed."""
+    cursor.execute("SELECT roles FROM users WHERE chat_id = %s", (chat_id,))
+    user_data = cursor.fetchone()
+    if not user_data:
+        return None
+    return list(user_data[0]) if user_data[0] else []
+
+def save_user_roles(cursor, chat_id, roles):
+    cursor.execute("""
+        INSERT INTO users (chat_id, roles) VALUES (%s, %s)
+        ON CONFLICT (chat_id) DO UPDATE SET roles = EXCLUDED.roles
+    """, (chat_id, roles))
+
+def remove_user_role(cursor, chat_id, role):
+    """Removes one role and returns the remaining roles, or None if the user isn't subscribed."""
+    cursor.execute(
+        "UPDATE users SET roles = array_remove(roles, %s) WHERE chat_id = %s RETURNING roles",
+        (role, chat_id)
+    )
+    user_data = cursor.fetchone()
+    if not user_data:
+        return None
+    return list(user_data[0]) if user_data[0] else []
+
+def delete_user(cursor, chat_id):
+    """Deletes the user, their sent-job history, buffered digest and undelivered alerts. Returns False if they weren't subscribed."""
+    cursor.execute("DELETE FROM users WHERE chat_id = %s RETURNING chat_id", (chat_id,))
+    if not cursor.fetchone():
+        return False
+    cursor.execute("DELETE FROM users_jobs_sent WHERE chat_id = %s", (chat_id,))
+    cursor.execute("DELETE FROM digest_queue WHERE chat_id = %s", (chat_id,))
+    cursor.execute("DELETE FROM alert_outbox WHERE chat_id = %s", (chat_id,))
+    return True
+
+def ingest_and_route(cursor, crawl_results, matches=None, roles_by_key=None, subscribers=None, sender_id=None):
+    """
+    Ingests one batch of crawl results and routes its new postings in a single transaction: digest users' jobs are
+    buffered and everyone else's alerts are queued in the alert outbox, claimed by `sender_id`. If any step fails
+    nothing is kept and the postings are new again next cycle; once committed, every alert is in the outbox until
+    it is delivered. Routing uses `subscribers` ({role: chat_ids} from a complete profile cache) when given.
+    Returns (new_jobs, digest jobs buffered, [(chat_id, job_link)] alerts queued).
+    """
+    new_jobs = ingest_jobs(cursor, crawl_results, matches, roles_by_key)
+    if not new_jobs:
+        return [], 0, []
+
+    if subscribers is not None:
+        jobs_by_user = route_jobs_in_memory(new_jobs, subscribers)
+    else:
+        jobs_by_user = route_new_jobs(cursor, new_jobs)
+    digest_modes = load_digest_modes(cursor, list(jobs_by_user)) if jobs_by_user else {}
+
+    # Digest users only get their jobs buffered, in one statement for the whole batch
+    pairs = [(chat_id, job.link) for chat_id, jobs in jobs_by_user.items() for job in jobs]
+    buffered = [(chat_id, link) for chat_id, link in pairs if chat_id in digest_modes]
+    queue_digest_jobs(cursor, buffered)
+    alerts = queue_alerts(cursor, [(chat_id, link) for chat_id, link in pairs if chat_id not in digest_modes], sender_id)
+    return new_jobs, len(buffered), alerts
+
+def record_dropped_jobs(cursor, rejected, given_up):
+    """
+    Forgets alerts and digest jobs Telegram rejected for good, e.g. because the user blocked the bot, and releases
+    the ones whose send was given up so a later cycle or flush tries them again.
+    """
+    clear_alerts(cursor, rejected)
+    clear_digest_jobs(cursor, rejected)
+    release_alerts(cursor, given_up)
+    release_digest_jobs(cursor, given_up)
+
+async def get_user_roles(chat_id):
+    """fetch_user_roles through the profile cache: Postgres is only queried on a cache miss."""
+    found, roles = profile_cache.lookup(chat_id)
+    if not found:
+        roles = await run_db(fetch_user_roles, chat_id)
+        profile_cache.put(chat_id, roles)
+    return list(roles) if roles is not None else None  # Callers may modify their copy
+
 # --- 1️⃣ /start Command ---
 async def start(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
@@ -28,19 +136,12 @@ async def start(update: Update, context: CallbackContext):
 
         logging.info(f"✅ /start command received from user {chat_id}")
 
-        conn = connect_db()
-        cursor = conn.cursor()
-
         # Check if user exists
-        cursor.execute("SELECT * FROM users WHERE chat_id = %s", (chat_id,))
-        user = cursor.fetchone()
-        if user:
+        if await get_user_roles(chat_id) is not None:
             logging.info(f"🔔 User {chat_id} is already subscribed.")
             await update.message.reply_text("You're already subscribed! You'll receive job alerts.")
-            conn.close()
             return ConversationHandler.END
 
-        conn.close()
         context.user_data["roles"] = []
         logging.info(f"🛠 Asking user {chat_id} for job preferences.")
         await update.message.reply_text("Welcome! Please enter the first role you're interested in (e.g., Software, Finance). Type 'done' when finished.")
@@ -69,22 +170,14 @@ async def collect_role(update: Update, context: CallbackContext):
                 return ROLE_ENTRY
             
             logging.info(f"✅ User {chat_id} finalized roles: {roles}")
-            conn = connect_db()
-            cursor = conn.cursor()
-
             # Store user preferences in PostgreSQL
-            cursor.execute("""
-                INSERT INTO users (chat_id, roles) VALUES (%s, %s)
-                ON CONFLICT (chat_id) DO UPDATE SET roles = EXCLUDED.roles
-            """, (chat_id, roles))
-            conn.commit()
-            conn.close()
+            await run_db(save_user_roles, chat_id, roles)
+            profile_cache.put(chat_id, roles)
             logging.info(f"💾 Saved user {chat_id} roles to database: {roles}")
 
             await update.message.reply_text(f"You're subscribed! You'll receive job alerts for: {', '.join(roles)}.")
 
-            # Start job alerts only for this user
-            start_user_scheduler(chat_id)
+            # The alert shards pick up the new roles on their next tick
             logging.info(f"🚀 Started job alerts for user {chat_id}")
 
             return ConversationHandler.END
@@ -110,20 +203,14 @@ async def collect_role(update: Update, context: CallbackContext):
 async def delete_role(update: Update, context: CallbackContext):
     """Starts the delete role process by showing the user their roles."""
     chat_id = update.message.chat_id
-    conn = connect_db()
-    cursor = conn.cursor()
 
     # Fetch user's current roles
-    cursor.execute("SELECT roles FROM users WHERE chat_id = %s", (chat_id,))
-    user_data = cursor.fetchone()
-    conn.close()
+    roles = await get_user_roles(chat_id)
 
-    if not user_data or not user_data[0]:
+    if not roles:
         await update.message.reply_text("⚠️ You don't have any roles to delete.")
         return ConversationHandler.END
 
-    roles = user_data[0]  # Assuming roles are stored as a PostgreSQL array (TEXT[])
-
     # Generate buttons for each role
     keyboard = [[InlineKeyboardButton(role, callback_data=f"delete_{role}")] for role in roles]
     keyboard.append([InlineKeyboardButton("✅ Done", callback_data="done_deleting")])  # Add Done button
@@ -142,17 +229,9 @@ async def handle_delete_role(update: Update, context: CallbackContext):
     chat_id = query.message.chat_id
     role_to_delete = query.data.replace("delete_", "")  # Extract role name from callback data
 
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    # ✅ Remove the role from the user's list
-    cursor.execute("UPDATE users SET roles = array_remove(roles, %s) WHERE chat_id = %s", (role_to_delete, chat_id))
-    conn.commit()
-
-    # ✅ Fetch updated roles
-    cursor.execute("SELECT roles FROM users WHERE chat_id = %s", (chat_id,))
-    updated_roles = cursor.fetchone()[0]  # Extract list from tuple
-    conn.close()
+    # ✅ Remove the role from the user's list and get the updated roles back
+    updated_roles = await run_db(remove_user_role, chat_id, role_to_delete)
+    profile_cache.put(chat_id, updated_roles)
 
     # ✅ If no roles remain, end the conversation
     if not updated_roles:
@@ -181,21 +260,14 @@ async def done_deleting(update: Update, context: CallbackContext):
 async def add_role(update: Update, context: CallbackContext):
     """Starts the role addition process."""
     chat_id = update.message.chat_id
-    conn = connect_db()
-    cursor = conn.cursor()
 
     # Fetch user's current roles
-    cursor.execute("SELECT roles FROM users WHERE chat_id = %s", (chat_id,))
-    user_data = cursor.fetchone()
-    
-    if not user_data:
+    existing_roles = await get_user_roles(chat_id)
+
+    if existing_roles is None:
         logging.warning(f"⚠️ User {chat_id} not found in database.")
         await update.message.reply_text("⚠️ You need to subscribe to job alerts first.")
         return ConversationHandler.END
-    else:
-        existing_roles = user_data[0] if user_data[0] else []
-
-    conn.close()
 
     context.user_data["roles"] = existing_roles  # Store current roles in memory
 
@@ -203,143 +275,398 @@ async def add_role(update: Update, context: CallbackContext):
 
     return ROLE_ENTRY  # Transition to role addition state
 
-# --- 3️⃣ Function to Start Job Alerts for a Specific User ---
-def start_user_scheduler(chat_id=None):
-    """Starts job alerts for a specific user or all users globally on bot start."""
-    global scheduler_started
-    
-    if chat_id:
-        job_id = f"job_{chat_id}"
-        
-        # Prevent duplicate jobs
-        if scheduler.get_job(job_id):
-            return
-        
-        scheduler.add_job(schedule_check_jobs_for_user, "interval", minutes=1, args=[chat_id], id=job_id)
-        logging.info(f"✅ Scheduled job alerts for user {chat_id}")
-    
-    else:
-        # Start checking jobs for ALL subscribed users
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT chat_id FROM users")
-        all_users = cursor.fetchall()
-        conn.close()
-        
-        for user in all_users:
-            chat_id = user[0]
-            job_id = f"job_{chat_id}"
-            
-            if not scheduler.get_job(job_id):
-                scheduler.add_job(schedule_check_jobs_for_user, "interval", minutes=1, args=[chat_id], id=job_id)
-                logging.info(f"✅ Scheduled job alerts for user {chat_id}")
+# --- 3️⃣ Function to Start the Job Alert Shards ---
+# Seconds before the first alert cycle. APScheduler never runs a first tick that is already due when it starts.
+ALERT_FIRST_DELAY = 1
+
+def start_user_scheduler(job_queue: JobQueue):
+    """
+    Schedules one repeating alert job per shard on the application's JobQueue, staggered across the interval.
+    Shard 0 polls right after startup; keywords that aren't due yet are skipped, so restarts don't over-poll.
+    """
+    if SCRAPER_MATCH_MODE == "local":
+        # The full listing is crawled once per cycle, so there is nothing to shard
+        if not job_queue.get_jobs_by_name("check_jobs_local"):
+            job_queue.run_repeating(
+                check_jobs_shard,
+                interval=ALERT_INTERVAL,
+                first=ALERT_FIRST_DELAY,
+                name="check_jobs_local",
+                data=None,
+                job_kwargs={"max_instances": 1, "coalesce": True},
+            )
+        logging.info(f"✅ Scheduled local-match job alerts every {ALERT_INTERVAL:g}s")
+        return
+
+    for shard in range(ALERT_SHARDS):
+        name = f"check_jobs_shard_{shard}"
+        if job_queue.get_jobs_by_name(name):
+            continue  # Prevent duplicate jobs
+
+        job_queue.run_repeating(
+            check_jobs_shard,
+            interval=ALERT_INTERVAL,
+            first=ALERT_FIRST_DELAY + ALERT_INTERVAL * shard / ALERT_SHARDS,  # Spread ticks so they don't all fire at :00
+            name=name,
+            data=shard,
+            job_kwargs={"max_instances": 1, "coalesce": True},  # A slow shard skips a tick instead of piling up
+        )
+    logging.info(f"✅ Scheduled {ALERT_SHARDS} job alert shards every {ALERT_INTERVAL:g}s")
+
+def shard_of(role):
+    """Stable shard number for a role, the same in every process."""
+    return zlib.crc32(role.encode("utf-8")) % ALERT_SHARDS
+
+async def check_jobs_shard(context: CallbackContext):
+    """JobQueue callback: runs the alert cycle for one shard of the roles."""
+    next_t = context.job.next_t  # Already moved on to the following run
+    if next_t is not None:
+        lag = datetime.now(next_t.tzinfo) - (next_t - timedelta(seconds=ALERT_INTERVAL))
+        SCHEDULER_LAG_SECONDS.observe(max(lag.total_seconds(), 0))
+
+    with timed(CYCLE_SECONDS):
+        await check_jobs_for_all_users(context.bot_data["dispatcher"], shard=context.job.data)
+
+def mark_startup():
+    """Starts the time-to-first-poll clock; call it first thing in the process's entry point."""
+    global _startup_began_at
+    _startup_began_at = time.monotonic()
+
+def _report_first_poll():
+    global _startup_began_at
+    if _startup_began_at is None:
+        return
+    elapsed = time.monotonic() - _startup_began_at
+    _startup_began_at = None
+    TIME_TO_FIRST_POLL.set(elapsed)
+    logging.info(f"⏱ First alert poll started {elapsed:.3f}s after startup")
+
+async def record_delivered_messages(messages):
+    """Dispatcher callback: marks jobs as sent only once Telegram has confirmed delivery."""
+    sent_jobs = [(message.chat_id, link) for message in messages for link in message.job_links]
+    await run_db(record_delivered_jobs, sent_jobs)
+
+async def record_dropped_messages(messages):
+    """Dispatcher callback for messages it didn't deliver, see record_dropped_jobs."""
+    rejected = [(message.chat_id, link) for message in messages if message.rejected for link in message.job_links]
+    given_up = [(message.chat_id, link) for message in messages if not message.rejected for link in message.job_links]
+    await run_db(record_dropped_jobs, rejected, given_up)
+
+def start_retention_job(job_queue: JobQueue):
+    """Schedules the sent history cleanup; it only needs to run in one process."""
+    job_queue.run_repeating(
+        prune_sent_history_job,
+        interval=SENT_HISTORY_PRUNE_INTERVAL,
+        first=SENT_HISTORY_PRUNE_INTERVAL / 10,
+        name="prune_sent_history",
+        job_kwargs={"max_instances": 1, "coalesce": True},
+    )
 
-    # Only start the scheduler if it's not already running
-    if not scheduler_started:
-        scheduler.start()
-        scheduler_started = True
-        logging.info("🚀 Scheduler started successfully!")
+def start_digest_job(job_queue: JobQueue):
+    """Schedules sending hourly and daily digests that are due; like the retention job it runs in one process."""
+    job_queue.run_repeating(
+        flush_digests_job,
+        interval=DIGEST_FLUSH_INTERVAL,
+        first=ALERT_FIRST_DELAY,
+        name="flush_digests",
+        job_kwargs={"max_instances": 1, "coalesce": True},
+    )
 
+async def flush_digests_job(context: CallbackContext):
+    await flush_due_digests(context.bot_data["dispatcher"])
 
-# --- 4️⃣ Check Jobs Only for This User ---
-async def check_jobs_for_user(chat_id):
-    """Fetches new job postings and sends alerts only for jobs the user hasn't seen."""
-    logging.info(f"🔍 Checking jobs for user {chat_id}")
+async def flush_due_digests(dispatcher, cadences=None):
+    """Claims due digests one batch of users at a time and queues them as packed messages. See claim_due_digests."""
+    users = queued = 0
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-
-        # Get user preferences
-        cursor.execute("SELECT roles FROM users WHERE chat_id = %s", (chat_id,))
-        user_data = cursor.fetchone()
-        if not user_data:
-            logging.warning(f"⚠️ No roles found for user {chat_id}. Skipping.")
-            conn.close()
-            return
-
-        roles = list(user_data[0]) if user_data[0] else []
-        logging.info(f"🛠 Fetching jobs for roles: {roles}")
-        # Get latest job postings from InternSG
-        jobs = scrape_internsg(roles)
-        cursor.execute("SELECT EXISTS (SELECT 1 FROM users_jobs_sent WHERE chat_id = %s)", (chat_id,))
-        is_first_time = not cursor.fetchone()[0]
+        while True:
+            digests = await run_db(claim_due_digests, cadences)
+            if not digests:
+                break
+            for chat_id, jobs in digests.items():
+                queued += enqueue_digest(dispatcher, chat_id, jobs)
+            users += len(digests)
+    except Exception as e:
+        logging.error(f"❌ Error flushing digests: {e}", exc_info=True)
+    if users:
+        logging.info(f"📰 Queued {queued} digest messages for {users} users")
+    return queued
 
-        for job in jobs:
-            job_link = job["link"]
+async def prune_sent_history_job(context: CallbackContext):
+    await prune_all_sent_history()
 
-            # Check if job was already sent to this user
-            cursor.execute(
-                "SELECT 1 FROM users_jobs_sent WHERE chat_id = %s AND job_link = %s",
-                (chat_id, job_link)
-            )
-            already_sent = cursor.fetchone()
-
-            if already_sent:
-                logging.info(f"🔄 Skipping already sent job: {job_link}")
-                continue  # Skip already sent jobs
-            if is_first_time:
-                cursor.execute(
-                    "INSERT INTO users_jobs_sent (chat_id, job_link, sent_at) VALUES (%s, %s, NOW())",
-                    (chat_id, job_link)
-                )
-                conn.commit()
-                logging.info(f"📌 First-time user {chat_id} - Storing job without sending: {job_link}")
-                continue  # Do NOT send messages to first-time users
-            
-            message = f"🔥 New Job: {job['title']} at {job['company']}\n📍 Location: {job['location']}\n🕒 Duration: {job['duration']}\n📅 Posted: {job['post_date']}\n🔗 {job['link']}"
-            await bot.send_message(chat_id=chat_id, text=message)
-            logging.info(f"✅ Sent job alert for {job['title']} to user {chat_id}")
-
-            # Mark this job as sent
-            cursor.execute(
-                "INSERT INTO users_jobs_sent (chat_id, job_link, sent_at) VALUES (%s, %s, NOW())",
-                (chat_id, job_link)
-            )
-
-            cursor.execute("""
-                DELETE FROM users_jobs_sent 
-                WHERE chat_id = %s 
-                AND job_link IN (
-                    SELECT job_link FROM users_jobs_sent
-                    WHERE chat_id = %s 
-                    ORDER BY sent_at ASC
-                    OFFSET 30
-                )
-            """, (chat_id, chat_id))
-            conn.commit()
+async def prune_all_sent_history():
+    """Walks every user in chat_id order, one short transaction per SENT_HISTORY_PRUNE_BATCH users."""
+    after_chat_id, deleted = -2**63, 0
+    try:
+        while True:
+            last_chat_id, batch_deleted = await run_db(prune_sent_history, after_chat_id, SENT_HISTORY_PRUNE_BATCH)
+            deleted += batch_deleted
+            if last_chat_id is None:
+                break
+            after_chat_id = last_chat_id
     except Exception as e:
-        logging.error(f"❌ Error in check_jobs_for_user(): {e}", exc_info=True)
+        logging.error(f"❌ Error pruning sent history: {e}", exc_info=True)
+    logging.info(f"🧹 Pruned {deleted} old sent history entries")
+    return deleted
+
+# --- 4️⃣ Check Jobs for All Users in One Shared Scrape ---
+async def check_jobs_for_all_users(dispatcher, shard=None):
+    """
+    Runs the alert cycle for one shard (or all roles), then resends undelivered alerts from the outbox. The last
+    shard of a round also flushes the "immediate" digests buffered by every shard, so each of those users gets
+    one packed digest per round.
+    """
+    try:
+        await check_due_roles(dispatcher, shard)
     finally:
-        if conn:
-            cursor.close()
-            conn.close() 
-
-def schedule_check_jobs_for_user(chat_id):
-    """Synchronous wrapper for async function."""
-    asyncio.run(check_jobs_for_user(chat_id)) 
+        await resend_undelivered_alerts(dispatcher)
+        if shard is None or shard == ALERT_SHARDS - 1:
+            await flush_due_digests(dispatcher, {"immediate": 0})
+
+async def check_due_roles(dispatcher, shard=None):
+    """
+    Crawls each distinct role that is due once on every enabled job source, ingests new postings into the catalog and routes them to subscribers.
+    In local match mode every role is matched against InternSG's full listing instead, whenever the listing is due.
+    """
+    _report_first_poll()
+    local = SCRAPER_MATCH_MODE == "local"
+    try:
+        # Roles come from memory when the profile cache is loaded
+        roles = profile_cache.roles() if profile_cache.complete else list(await run_db(load_role_keywords, False))
+    except Exception as e:
+        logging.error(f"❌ Error loading roles in check_due_roles(): {e}", exc_info=True)
+        return
+
+    if shard is not None:
+        roles = [role for role in roles if shard_of(role) == shard]
+    if not roles:
+        return
+
+    cycle_links = set()  # Postings found new so far this cycle
+    queued = 0
+    if local:
+        crawl_results, matches = await crawl_and_match_locally(roles)
+        if crawl_results is None:
+            return
+        queued += await deliver_new_jobs(dispatcher, crawl_results, matches, cycle_links)
+    else:
+        # Every enabled source searches every role, each source under its own crawl state key
+        targets = {source.state_key(role): (source, role) for source in enabled_sources() for role in roles}
+        try:
+            high_water_by_key = await run_db(load_high_water_links, list(targets))
+        except Exception as e:
+            logging.error(f"❌ Error loading high-water marks in check_due_roles(): {e}", exc_info=True)
+            return
+        if not high_water_by_key:
+            return
 
-# --- 5️⃣ /stop Command ---
+        roles_by_key = {key: role for key, (_, role) in targets.items()}
+        due = {key: (*targets[key], high_water_link) for key, high_water_link in high_water_by_key.items()}
+        logging.info(f"🔍 Checking jobs for {len(due)} due role searches (shard {shard})")
+        # Each crawl stops at its high-water mark, so only rows newer than the last poll are parsed.
+        # Batches are delivered as searches finish, so the first alerts wait for neither the slowest keyword
+        # nor the slowest source.
+        async for crawl_results in stream_source_results(due):
+            queued += await deliver_new_jobs(dispatcher, crawl_results, None, cycle_links, roles_by_key)
+
+    if not cycle_links:
+        logging.info(f"🔄 No new postings this cycle (shard {shard})")
+        return
+
+    logging.info(f"🆕 {len(cycle_links)} new postings found, {queued} job alerts queued (shard {shard})")
+    logging.info(f"🗄 DB pool stats: {db_pool.stats()}")
+    logging.info(f"📬 Dispatcher stats: {dispatcher.stats()}")
+
+async def deliver_new_jobs(dispatcher, crawl_results, matches, cycle_links, roles_by_key=None):
+    """
+    Ingests one batch of crawl results, routes its new postings to subscribers and queues their alerts.
+    Adds the batch's new links to `cycle_links` and returns the number of alerts queued.
+    """
+    subscribers = None
+    if profile_cache.complete:
+        # Copied here, on the event loop, for routing on the database thread
+        roles = matches if matches is not None else {(roles_by_key or {}).get(key, key) for key in crawl_results}
+        subscribers = profile_cache.snapshot(roles)
+    try:
+        # Work from here on scales with the number of genuinely new postings
+        new_jobs, buffered, alerts = await run_db(
+            ingest_and_route, crawl_results, matches, roles_by_key, subscribers, dispatcher.sender_id
+        )
+    except Exception as e:
+        logging.error(f"❌ Error ingesting jobs in deliver_new_jobs(): {e}", exc_info=True)
+        return 0
+
+    fresh_links = {job.link for job, _ in new_jobs} - cycle_links
+    NEW_POSTINGS.inc(len(fresh_links))
+    cycle_links.update(fresh_links)
+    DIGEST_JOBS_BUFFERED.inc(buffered)
+
+    jobs_by_link = {job.link: job for job, _ in new_jobs}
+    jobs_by_user = {}
+    for chat_id, link in alerts:
+        jobs_by_user.setdefault(chat_id, []).append(jobs_by_link[link])
+    return sum(enqueue_alerts(dispatcher, chat_id, jobs) for chat_id, jobs in jobs_by_user.items())
+
+async def resend_undelivered_alerts(dispatcher):
+    """Claims a batch of outbox alerts nobody is sending any more (see claim_undelivered_alerts) and queues them."""
+    try:
+        alerts = await run_db(claim_undelivered_alerts, dispatcher.sender_id)
+    except Exception as e:
+        logging.error(f"❌ Error claiming undelivered alerts: {e}", exc_info=True)
+        return 0
+    queued = sum(enqueue_alerts(dispatcher, chat_id, jobs) for chat_id, jobs in alerts.items())
+    if alerts:
+        logging.info(f"📮 Requeued {queued} undelivered job alerts for {len(alerts)} users")
+    return queued
+
+async def crawl_and_match_locally(roles):
+    """
+    Crawls the full listing once and matches every role against an in-memory index of the new rows.
+    Returns (crawl_results, {role: jobs}) for ingest_jobs, or (None, None) if the listing couldn't be fetched.
+    """
+    try:
+        due = await run_db(load_high_water_links, [ALL_LISTINGS_KEYWORD])
+    except Exception as e:
+        logging.error(f"❌ Error loading the listing high-water mark: {e}", exc_info=True)
+        return None, None
+    if ALL_LISTINGS_KEYWORD not in due:
+        return None, None  # The listing's adaptive interval hasn't elapsed yet
+    high_water_link = due[ALL_LISTINGS_KEYWORD]
+
+    logging.info(f"🔍 Matching {len(roles)} distinct roles against the full listing")
+    result = await crawl_all_listings_async(high_water_link)
+    if result is None:
+        return None, None
+
+    jobs, new_high_water_link = result
+    matches = ListingIndex(jobs).match_all(roles)
+    logging.info(f"🧮 {len(jobs)} new listings matched {sum(map(len, matches.values()))} times across {len(roles)} roles")
+    return {ALL_LISTINGS_KEYWORD: (jobs, new_high_water_link)}, matches
+
+# --- 5️⃣ Send New Jobs to One User ---
+def enqueue_alerts(dispatcher, chat_id, jobs):
+    """
+    Queues one alert per job, leaving out jobs already on their way; they are recorded once delivered.
+    Returns the number of messages queued. Per-user logging is DEBUG only, the cycle logs a summary.
+    """
+    queued = 0
+    for job in jobs:
+        message = f"🔥 New Job: {job.title} at {job.company}\n📍 Location: {job.location}\n🕒 Duration: {job.duration}\n📅 Posted: {job.post_date}\n🔗 {job.link}"
+        if dispatcher.enqueue(chat_id, message, job_links=[job.link]):
+            queued += 1
+            logging.debug(f"✅ Queued job alert for {job.title} to user {chat_id}")
+    ALERTS_QUEUED.inc(queued)
+    return queued
+
+def enqueue_digest(dispatcher, chat_id, jobs):
+    """Queues `jobs` as packed digest messages, leaving out jobs already on their way. Returns the messages queued."""
+    jobs = [job for job in jobs if not dispatcher.is_pending(chat_id, job.link)]
+    queued = 0
+    for text, job_links in pack_digest(jobs):
+        if dispatcher.enqueue(chat_id, text, job_links=job_links):
+            queued += 1
+    ALERTS_QUEUED.inc(queued)
+    return queued
+
+# --- 6️⃣ /stop Command ---
 async def stop(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    # Check if the user exists
-    cursor.execute("SELECT * FROM users WHERE chat_id = %s", (chat_id,))
-    user = cursor.fetchone()
 
-    if not user:
+    # Delete the user if they exist
+    deleted = await run_db(delete_user, chat_id)
+    profile_cache.put(chat_id, None)
+    if not deleted:
         await update.message.reply_text("You are not subscribed to job alerts.")
     else:
-        cursor.execute("DELETE FROM users WHERE chat_id = %s", (chat_id,))
-        cursor.execute("DELETE FROM users_jobs_sent WHERE chat_id = %s", (chat_id,))
-        conn.commit()
         await update.message.reply_text("You've unsubscribed from job alerts.")
 
-    conn.close()
     return ConversationHandler.END
 
-# --- 6️⃣ Register Handlers ---
+# --- 7️⃣ /digest Command ---
+DIGEST_LABELS = {
+    "off": "🔔 Every job right away",
+    "immediate": "📦 Batched right away",
+    "hourly": "🕐 Hourly digest",
+    "daily": "📅 Daily digest",
+}
+
+def digest_keyboard(current):
+    keyboard = [
+        [InlineKeyboardButton(("✅ " if mode == current else "") + DIGEST_LABELS[mode], callback_data=f"digest_{mode}")]
+        for mode in DIGEST_MODES
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def digest(update: Update, context: CallbackContext):
+    """Shows the user's digest mode with buttons to change it."""
+    chat_id = update.message.chat_id
+    mode = await run_db(fetch_digest_mode, chat_id)
+    if mode is None:
+        await update.message.reply_text("⚠️ You need to subscribe to job alerts first.")
+        return
+
+    await update.message.reply_text("📰 How should new jobs be delivered?", reply_markup=digest_keyboard(mode))
+
+async def handle_digest_choice(update: Update, context: CallbackContext):
+    """Handles the button click event for choosing a digest mode."""
+    query = update.callback_query
+    await query.answer()
+    chat_id = query.message.chat_id
+    mode = query.data.replace("digest_", "")
+    if mode not in DIGEST_MODES:
+        return
+
+    if not await run_db(set_digest_mode, chat_id, mode):
+        await query.edit_message_text("⚠️ You need to subscribe to job alerts first.")
+        return
+
+    logging.info(f"📰 User {chat_id} switched digest mode to {mode}")
+    await query.edit_message_text(f"✅ Delivery set to: {DIGEST_LABELS[mode]}", reply_markup=digest_keyboard(mode))
+
+# --- 8️⃣ /stats Command (admins only) ---
+def _latency(name, **labels):
+    """'p50 ≤ X ms, p95 ≤ Y ms (n)' from a histogram's buckets."""
+    metric = REGISTRY.get(name)
+    count = metric.count(**labels) if metric else 0
+    if not count:
+        return "no samples"
+    p50, p95 = (metric.quantile(q, **labels) * 1000 for q in (0.5, 0.95))
+    return f"p50 ≤ {p50:g} ms, p95 ≤ {p95:g} ms ({count})"
+
+def format_stats(dispatcher=None):
+    fetches = REGISTRY.get("scraper_fetches_total")
+    rows = REGISTRY.get("scraper_rows_total")
+    lines = [
+        "📊 Bot stats",
+        f"👥 Cached profiles: {len(profile_cache)} (complete: {profile_cache.complete}, hits {profile_cache.hits}, misses {profile_cache.misses})",
+        f"🌐 InternSG fetches: {_latency('scraper_fetch_seconds')}",
+        f"♻️ Page cache: {fetches.value(result='hit')} hits, {fetches.value(result='not_modified')} unchanged, "
+        f"{fetches.value(result='changed')} changed, {fetches.value(result='error')} errors",
+        f"🧩 Parsing: {_latency('scraper_parse_seconds')}, {rows.value(result='ok')} rows, {rows.value(result='skipped')} skipped",
+        f"🗄 DB calls: {_latency('db_query_seconds')}",
+        f"🗄 DB pool: {db_pool.stats()}",
+        f"⏱ Scheduler lag: {_latency('alert_scheduler_lag_seconds')}",
+        f"🔁 Alert cycles: {_latency('alert_cycle_seconds')}",
+        f"🆕 New postings: {NEW_POSTINGS.total()}, alerts queued: {ALERTS_QUEUED.total()}, "
+        f"jobs buffered for digests: {DIGEST_JOBS_BUFFERED.total()}",
+        f"📤 Telegram sends: {_latency('telegram_send_seconds')}",
+    ]
+    if dispatcher is not None:
+        lines.append(f"📬 Dispatcher: {dispatcher.stats()}")
+    return "\n".join(lines)
+
+async def stats(update: Update, context: CallbackContext):
+    chat_id = update.message.chat_id
+    if chat_id not in ADMIN_CHAT_IDS:
+        logging.warning(f"⚠️ User {chat_id} tried to use /stats without being an admin.")
+        await update.message.reply_text("⚠️ This command is for admins only.")
+        return
+
+    logging.info(f"📊 /stats requested by admin {chat_id}")
+    await update.message.reply_text(format_stats(context.bot_data.get("dispatcher")))
+
+# --- 9️⃣ Register Handlers ---
 def register_handlers(app: Application):
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
@@ -367,3 +694,6 @@ def register_handlers(app: Application):
     app.add_handler(delete_conv_handler)
     app.add_handler(add_conv_handler)
     app.add_handler(CommandHandler("stop", stop))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("digest", digest))
+    app.add_handler(CallbackQueryHandler(handle_digest_choice, pattern=r"^digest_"))
@@ -0,0 +1,195 @@
+"""
+Versioned schema migrations, applied once by the bot, each worker and the benchmark before they touch the database,
+or explicitly as a deploy step:
+
+    python -m bot.migrations
+
+Every migration runs at most once per database (see the schema_version table). Migrations 1-4 use IF NOT EXISTS
+so databases created before versioning adopt them without changes. Append new migrations, never edit applied ones.
+"""
+import logging
+from bot.config import db_cursor
+
+# pg_advisory_xact_lock key, so processes starting together apply migrations one at a time
+MIGRATION_LOCK_ID = 0x696b6d67  # "ikmg"
+
+def _initial_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            chat_id BIGINT PRIMARY KEY,
+            roles TEXT[]
+        );
+    """)
+    # Global catalog: every posting is stored once, keyed by a compact job_id
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id BIGSERIAL PRIMARY KEY,
+            link TEXT NOT NULL UNIQUE,
+            title TEXT,
+            company TEXT,
+            location TEXT,
+            duration TEXT,
+            post_date TEXT,
+            first_seen_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+    # Keywords that have been scraped at least once; a keyword's first scrape is only a baseline
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS keywords (
+            keyword TEXT PRIMARY KEY,
+            first_scraped_at TIMESTAMP DEFAULT NOW(),
+            last_scraped_at TIMESTAMP
+        );
+    """)
+    # Lets new jobs be routed with `roles && ARRAY[...]` instead of scanning every user
+    cur.execute("CREATE INDEX IF NOT EXISTS users_roles_gin ON users USING GIN (roles);")
+
+def _keyword_crawl_state(cur):
+    # Newest link seen for each keyword, so the next crawl can stop as soon as it reaches it,
+    # and the adaptive polling state, kept across restarts
+    cur.execute("""
+        ALTER TABLE keywords
+        ADD COLUMN IF NOT EXISTS high_water_link TEXT,
+        ADD COLUMN IF NOT EXISTS poll_interval REAL,
+        ADD COLUMN IF NOT EXISTS polls INT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS new_jobs INT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS last_new_at TIMESTAMP;
+    """)
+
+def _alert_shards(cur):
+    # Lease queue for bot.worker processes: each shard is run by whichever worker holds its lease
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS alert_shards (
+            shard_id INT PRIMARY KEY,
+            leased_by TEXT,
+            lease_expires_at TIMESTAMPTZ,
+            next_run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            last_run_at TIMESTAMPTZ
+        );
+    """)
+
+# Sent history keyed by a 64-bit hash of the job link (see catalog.link_hash) instead of the full URL
+CREATE_SENT_HISTORY = """
+    CREATE TABLE IF NOT EXISTS users_jobs_sent (
+        chat_id BIGINT NOT NULL,
+        link_hash BIGINT NOT NULL,
+        sent_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (chat_id, link_hash)
+    );
+"""
+
+def _sent_history_hashes(cur):
+    """Creates the hashed sent history, converting a users_jobs_sent table that still stores full job links."""
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'users_jobs_sent' AND column_name = 'job_link'
+    """)
+    if cur.fetchone() is not None:
+        logging.info("🛠 Migrating users_jobs_sent from job links to link hashes...")
+        cur.execute("ALTER TABLE users_jobs_sent RENAME TO users_jobs_sent_links;")
+        cur.execute("ALTER TABLE users_jobs_sent_links RENAME CONSTRAINT users_jobs_sent_pkey TO users_jobs_sent_links_pkey;")
+        cur.execute(CREATE_SENT_HISTORY)
+        # Same value as catalog.link_hash: the first 8 bytes of the link's MD5 as a signed big-endian integer
+        cur.execute("""
+            INSERT INTO users_jobs_sent (chat_id, link_hash, sent_at)
+            SELECT chat_id, ('x' || substr(md5(job_link), 1, 16))::bit(64)::bigint, COALESCE(sent_at, NOW())
+            FROM users_jobs_sent_links
+            ON CONFLICT DO NOTHING;
+        """)
+        cur.execute("DROP TABLE users_jobs_sent_links;")
+
+    cur.execute(CREATE_SENT_HISTORY)
+    # Lets the retention job find each user's oldest entries without sorting their history
+    cur.execute("CREATE INDEX IF NOT EXISTS users_jobs_sent_chat_sent_at ON users_jobs_sent (chat_id, sent_at);")
+
+def _digest_mode(cur):
+    # Per-user digest mode (see bot.digest) and the jobs buffered for hourly and daily digests
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS digest TEXT NOT NULL DEFAULT 'off';")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS digest_queue (
+            chat_id BIGINT NOT NULL,
+            job_id BIGINT NOT NULL,
+            queued_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            claimed_at TIMESTAMPTZ,
+            PRIMARY KEY (chat_id, job_id)
+        );
+    """)
+
+def _job_keywords(cur):
+    # Keywords (roles) that have found each posting, so a posting counts as new once per keyword,
+    # not only for the keyword whose crawl first stored it
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS job_keywords (
+            job_id BIGINT NOT NULL,
+            keyword TEXT NOT NULL,
+            PRIMARY KEY (job_id, keyword)
+        );
+    """)
+
+def _telegram_senders(cur):
+    # Processes currently sending for the bot token, so they can split Telegram's global rate limit
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_senders (
+            sender_id TEXT PRIMARY KEY,
+            seen_at TIMESTAMPTZ NOT NULL
+        );
+    """)
+
+def _alert_outbox(cur):
+    # Per-job alerts routed to a user and not yet confirmed delivered (see bot.outbox)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            chat_id BIGINT NOT NULL,
+            job_id BIGINT NOT NULL,
+            queued_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            claimed_by TEXT,
+            claimed_at TIMESTAMPTZ,
+            PRIMARY KEY (chat_id, job_id)
+        );
+    """)
+
+# (version, name, migration) in the order they are applied
+MIGRATIONS = [
+    (1, "initial tables", _initial_tables),
+    (2, "keyword crawl state", _keyword_crawl_state),
+    (3, "alert shard leases", _alert_shards),
+    (4, "hashed sent history", _sent_history_hashes),
+    (5, "digest mode", _digest_mode),
+    (6, "job keywords", _job_keywords),
+    (7, "telegram senders", _telegram_senders),
+    (8, "alert outbox", _alert_outbox),
+]
+
+def apply_migrations(cursor):
+    """Applies every pending migration in one transaction and returns their versions."""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    current = cursor.fetchone()[0]
+
+    applied = []
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logging.info(f"🛠 Applying migration {version}: {name}")
+        migration(cursor)
+        cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+        applied.append(version)
+
+    logging.info(f"🗄 Database schema is at version {MIGRATIONS[-1][0]}")
+    return applied
+
+def migrate():
+    """Synchronous entry point for deploy scripts and `python -m bot.migrations`."""
+    with db_cursor() as cursor:
+        return apply_migrations(cursor)
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    migrate()
@@ -0,0 +1,96 @@
+"""
+Alert outbox: every per-job alert routed to a user is stored in the alert_outbox table, in the same transaction
+that ingested and routed its posting, before it is handed to the in-memory dispatcher queue.
+
+A row is claimed by the process that queued it (its dispatcher's sender_id) and deleted once Telegram has confirmed
+the send, in the same transaction that adds it to the sent history. Rows released after a failed send, rows claimed
+by a process that stopped sending (see the telegram_senders table) and rows claimed more than ALERT_RECLAIM_AFTER
+seconds ago are claimed again by the next alert cycle of any process, so a crash, a restart or a Telegram outage
+delays an alert instead of losing it. The (chat_id, job_id) primary key is also the cross-process claim: two
+processes routing the same posting to the same user at the same time queue it once.
+"""
+import os
+from bot.catalog import JOB_FIELDS, link_hash
+from scraper.parsers import JobRecord
+
+ALERT_RECLAIM_AFTER = float(os.getenv("ALERT_RECLAIM_AFTER", "900"))  # Claimed but unconfirmed alerts are resent after this
+ALERT_RECLAIM_BATCH = int(os.getenv("ALERT_RECLAIM_BATCH", "500"))  # Alerts reclaimed per alert cycle
+
+def queue_alerts(cursor, alerts, sender_id=None):
+    """
+    Adds (chat_id, job_link) alerts to the outbox, claimed by `sender_id`, and returns the ones this call added.
+    Alerts already in the outbox (queued by any process) or in the user's sent history are left out.
+    """
+    if not alerts:
+        return []
+    cursor.execute("""
+        WITH inserted AS (
+            INSERT INTO alert_outbox (chat_id, job_id, claimed_by, claimed_at)
+            SELECT c.chat_id, j.job_id, %(sender_id)s, NOW()
+            FROM unnest(%(chat_ids)s::bigint[], %(links)s::text[], %(hashes)s::bigint[]) AS c(chat_id, link, link_hash)
+            JOIN jobs j ON j.link = c.link
+            WHERE NOT EXISTS (
+                SELECT 1 FROM users_jobs_sent s WHERE s.chat_id = c.chat_id AND s.link_hash = c.link_hash
+            )
+            ON CONFLICT DO NOTHING
+            RETURNING chat_id, job_id
+        )
+        SELECT i.chat_id, j.link FROM inserted i JOIN jobs j ON j.job_id = i.job_id
+    """, {
+        "sender_id": sender_id,
+        "chat_ids": [chat_id for chat_id, _ in alerts],
+        "links": [link for _, link in alerts],
+        "hashes": [link_hash(link) for _, link in alerts],
+    })
+    return cursor.fetchall()
+
+def claim_undelivered_alerts(cursor, sender_id=None, batch_size=ALERT_RECLAIM_BATCH, reclaim_after=ALERT_RECLAIM_AFTER):
+    """
+    Claims up to `batch_size` alerts nobody is sending any more for `sender_id` and returns {chat_id: [JobRecord]}:
+    released after a failed send, claimed by a process missing from telegram_senders, or claimed too long ago.
+    """
+    cursor.execute(f"""
+        WITH due AS (
+            SELECT o.chat_id, o.job_id
+            FROM alert_outbox o
+            WHERE o.claimed_at IS NULL
+            OR o.claimed_at < NOW() - make_interval(secs => %(reclaim)s)
+            OR (o.claimed_by IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM telegram_senders t WHERE t.sender_id = o.claimed_by))
+            ORDER BY o.queued_at
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE alert_outbox o
+        SET claimed_by = %(sender_id)s, claimed_at = NOW()
+        FROM due, jobs j
+        WHERE o.chat_id = due.chat_id AND o.job_id = due.job_id AND j.job_id = o.job_id
+        RETURNING o.chat_id, {', '.join(f"j.{field}" for field in JOB_FIELDS)}
+    """, {"sender_id": sender_id, "reclaim": reclaim_after, "batch_size": batch_size})
+
+    alerts = {}
+    for chat_id, *fields in cursor.fetchall():
+        values = dict(zip(JOB_FIELDS, fields))
+        alerts.setdefault(chat_id, []).append(JobRecord(*(values[field] for field in JobRecord._fields)))
+    return alerts
+
+def clear_alerts(cursor, alerts):
+    """Deletes (chat_id, job_link) alerts that were delivered, or that Telegram rejected for good."""
+    if not alerts:
+        return
+    cursor.execute("""
+        DELETE FROM alert_outbox o
+        USING unnest(%s::bigint[], %s::text[]) AS c(chat_id, link), jobs j
+        WHERE j.link = c.link AND o.chat_id = c.chat_id AND o.job_id = j.job_id
+    """, ([chat_id for chat_id, _ in alerts], [link for _, link in alerts]))
+
+def release_alerts(cursor, alerts):
+    """Unclaims alerts whose send was given up, so the next alert cycle of any process tries them again."""
+    if not alerts:
+        return
+    cursor.execute("""
+        UPDATE alert_outbox o
+        SET claimed_by = NULL, claimed_at = NULL
+        FROM unnest(%s::bigint[], %s::text[]) AS c(chat_id, link), jobs j
+        WHERE j.link = c.link AND o.chat_id = c.chat_id AND o.job_id = j.job_id
+    """, ([chat_id for chat_id, _ in alerts], [link for _, link in alerts]))
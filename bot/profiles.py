@@ -0,0 +1,103 @@
+import os
+import logging
+from collections import OrderedDict
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "50000"))  # Max users whose roles are kept in memory
+
+def load_all_profiles(cursor):
+    """Returns (chat_id, roles) for every subscribed user in one query."""
+    cursor.execute("SELECT chat_id, roles FROM users")
+    return [(chat_id, list(roles) if roles else []) for chat_id, roles in cursor.fetchall()]
+
+class ProfileCache:
+    """
+    Bounded LRU of chat_id -> roles, kept in sync by the handlers that write users.roles.
+    A cached None means the user is known not to be subscribed. While `complete` is True the
+    cache holds every subscribed user, so misses need no DB lookup and jobs can be routed in memory;
+    unsubscribed users are then simply left out instead of taking room from subscribed ones.
+    """
+
+    def __init__(self, max_size=PROFILE_CACHE_SIZE):
+        self.max_size = max_size
+        self.complete = False
+        self._profiles = OrderedDict()
+        self._subscribers = {}  # role -> chat_ids, for routing without a query
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self, profiles):
+        """Replaces the contents with a bulk load of (chat_id, roles); complete only if everything fit."""
+        self.clear()
+        for chat_id, roles in profiles:
+            self.put(chat_id, roles)
+        self.complete = len(profiles) <= self.max_size
+        logging.info(f"👥 Profile cache warmed with {len(self._profiles)} users (complete: {self.complete})")
+
+    def lookup(self, chat_id):
+        """Returns (found, roles). With a complete cache, unknown users are reported as not subscribed."""
+        if chat_id in self._profiles:
+            self._profiles.move_to_end(chat_id)
+            self.hits += 1
+            return True, self._profiles[chat_id]
+        if self.complete:
+            self.hits += 1
+            return True, None
+        self.misses += 1
+        return False, None
+
+    def put(self, chat_id, roles):
+        """Write-through update after users.roles changed; roles=None records an unsubscribed user."""
+        self._unindex(chat_id)
+        if roles is None and self.complete:
+            self._profiles.pop(chat_id, None)  # A complete cache already reports unknown chats as unsubscribed
+            return
+        self._profiles[chat_id] = list(roles) if roles is not None else None
+        self._profiles.move_to_end(chat_id)
+        for role in roles or ():
+            self._subscribers.setdefault(role, set()).add(chat_id)
+
+        while len(self._profiles) > self.max_size:
+            evicted, roles = self._profiles.popitem(last=False)
+            self._unindex(evicted, roles)
+            if roles is not None:
+                self.complete = False  # A subscribed user is no longer in memory
+
+    def subscribers(self, role):
+        return self._subscribers.get(role, ())
+
+    def snapshot(self, roles):
+        """{role: chat_ids} copied for the given roles, safe to route with on a database thread."""
+        return {role: frozenset(self.subscribers(role)) for role in roles}
+
+    def roles(self):
+        """Every role followed by at least one cached user."""
+        return list(self._subscribers)
+
+    def _unindex(self, chat_id, roles=None):
+        if roles is None:
+            roles = self._profiles.get(chat_id)
+        for role in roles or ():
+            chat_ids = self._subscribers.get(role)
+            if chat_ids is not None:
+                chat_ids.discard(chat_id)
+                if not chat_ids:
+                    del self._subscribers[role]
+
+    def clear(self):
+        self._profiles.clear()
+        self._subscribers.clear()
+        self.complete = False
+
+    def __len__(self):
+        return len(self._profiles)
+
+profile_cache = ProfileCache()
+
+def route_jobs_in_memory(new_jobs, subscribers):
+    """Same result as catalog.route_new_jobs, answered from a complete profile cache's snapshot of the keywords."""
+    jobs_by_user = {}
+    for job, keywords in new_jobs:
+        for keyword in keywords:
+            for chat_id in subscribers.get(keyword, ()):
+                jobs_by_user.setdefault(chat_id, {}).setdefault(job.link, job)
+    return {chat_id: list(jobs.values()) for chat_id, jobs in jobs_by_user.items()}
@@ -0,0 +1,174 @@
+import os
+import socket
+import signal
+import asyncio
+import logging
+from telegram import Bot
+from bot.bot import BOT_TOKEN, LOG_LEVEL, METRICS_PORT, TELEGRAM_BASE_URL
+from bot.config import db_pool, run_db
+from bot.dispatcher import MessageDispatcher
+from bot.handlers import (
+    ALERT_INTERVAL, ALERT_SHARDS, CYCLE_SECONDS, SCHEDULER_LAG_SECONDS, SCRAPER_MATCH_MODE,
+    check_jobs_for_all_users, mark_startup, record_delivered_messages, record_dropped_messages
+)
+from bot.migrations import apply_migrations
+from metrics import start_metrics_server, timed
+from scraper.utils import close_async_client
+
+# Worker settings
+ALERT_LEASE_SECONDS = float(os.getenv("ALERT_LEASE_SECONDS", "120"))  # A dead worker's shard is picked up after this
+ALERT_WORKER_SLOTS = int(os.getenv("ALERT_WORKER_SLOTS", "1"))  # Shards one worker process runs at the same time
+ALERT_WORKER_POLL = float(os.getenv("ALERT_WORKER_POLL", "1"))  # Seconds between claim attempts when nothing is due
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# --- Lease Queue (alert_shards table) ---
+def ensure_shards(cursor, shard_count, interval):
+    """Creates missing shard rows, with their first runs staggered across the interval."""
+    cursor.execute("""
+        INSERT INTO alert_shards (shard_id, next_run_at)
+        SELECT shard_id, NOW() + make_interval(secs => %s * shard_id / %s)
+        FROM generate_series(0, %s - 1) AS shard_id
+        ON CONFLICT (shard_id) DO NOTHING
+    """, (interval, shard_count, shard_count))
+
+def claim_shard(cursor, worker_id, lease_seconds, shard_count):
+    """
+    Leases the most overdue shard nobody holds; SKIP LOCKED lets concurrent workers claim different rows.
+    Returns (shard_id, seconds it is overdue) or None.
+    """
+    cursor.execute("""
+        UPDATE alert_shards
+        SET leased_by = %s, lease_expires_at = NOW() + make_interval(secs => %s)
+        WHERE shard_id = (
+            SELECT shard_id FROM alert_shards
+            WHERE shard_id < %s
+            AND next_run_at <= NOW()
+            AND (lease_expires_at IS NULL OR lease_expires_at < NOW())
+            ORDER BY next_run_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING shard_id, EXTRACT(EPOCH FROM NOW() - next_run_at)
+    """, (worker_id, lease_seconds, shard_count))
+    row = cursor.fetchone()
+    return (row[0], float(row[1])) if row else None
+
+def renew_lease(cursor, shard_id, worker_id, lease_seconds):
+    """Extends a held lease. Returns False if it already expired and was taken over."""
+    cursor.execute("""
+        UPDATE alert_shards SET lease_expires_at = NOW() + make_interval(secs => %s)
+        WHERE shard_id = %s AND leased_by = %s
+        RETURNING shard_id
+    """, (lease_seconds, shard_id, worker_id))
+    return cursor.fetchone() is not None
+
+def release_shard(cursor, shard_id, worker_id, next_run_in):
+    """Gives the shard back and schedules its next run `next_run_in` seconds from now."""
+    cursor.execute("""
+        UPDATE alert_shards
+        SET leased_by = NULL, lease_expires_at = NULL, last_run_at = NOW(),
+            next_run_at = NOW() + make_interval(secs => %s)
+        WHERE shard_id = %s AND leased_by = %s
+    """, (next_run_in, shard_id, worker_id))
+
+def shard_count():
+    # Local matching crawls the full listing once per cycle, so there is a single shard
+    return 1 if SCRAPER_MATCH_MODE == "local" else ALERT_SHARDS
+
+# --- Worker Loop ---
+async def run_leased_shard(dispatcher, shard):
+    """Runs one alert cycle for a leased shard, renewing the lease until it finishes."""
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(ALERT_LEASE_SECONDS / 3)
+            try:
+                renewed = await run_db(renew_lease, shard, WORKER_ID, ALERT_LEASE_SECONDS)
+            except Exception as e:
+                logging.error(f"❌ Error renewing the lease on shard {shard}: {e}", exc_info=True)
+                continue
+            if not renewed:
+                logging.warning(f"⚠️ Lost the lease on shard {shard}, another worker may run it too")
+                return
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    next_run_in = ALERT_INTERVAL
+    try:
+        with timed(CYCLE_SECONDS):
+            await check_jobs_for_all_users(dispatcher, shard=None if shard_count() == 1 else shard)
+    except Exception as e:
+        next_run_in = 0  # Let any worker retry it straight away
+        logging.error(f"❌ Error running shard {shard}: {e}", exc_info=True)
+    finally:
+        heartbeat_task.cancel()
+        try:
+            await run_db(release_shard, shard, WORKER_ID, next_run_in)
+        except Exception as e:
+            logging.error(f"❌ Error releasing shard {shard}, it will be reclaimed once the lease expires: {e}", exc_info=True)
+
+async def worker_loop(dispatcher, stop_event):
+    while not stop_event.is_set():
+        try:
+            claimed = await run_db(claim_shard, WORKER_ID, ALERT_LEASE_SECONDS, shard_count())
+        except Exception as e:
+            claimed = None
+            logging.error(f"❌ Error claiming an alert shard: {e}", exc_info=True)
+
+        if claimed is None:
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=ALERT_WORKER_POLL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        shard, lag = claimed
+        SCHEDULER_LAG_SECONDS.observe(max(lag, 0))
+        logging.info(f"🔒 Worker {WORKER_ID} leased shard {shard} ({lag:.1f}s overdue)")
+        await run_leased_shard(dispatcher, shard)
+
+async def run_worker_async(stop_event=None):
+    """Claims alert shards from Postgres until `stop_event` is set. Any number of workers can run side by side."""
+    stop_event = stop_event or asyncio.Event()
+    await run_db(apply_migrations)
+    await run_db(ensure_shards, shard_count(), ALERT_INTERVAL)
+
+    metrics_server = await start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+    bot = Bot(BOT_TOKEN, base_url=TELEGRAM_BASE_URL)
+    async with bot:
+        dispatcher = MessageDispatcher(
+            bot, on_delivered=record_delivered_messages, on_dropped=record_dropped_messages, sender_id=WORKER_ID
+        )
+        await dispatcher.start()
+        logging.info(f"👷 Alert worker {WORKER_ID} started with {ALERT_WORKER_SLOTS} slots")
+        try:
+            await asyncio.gather(*(worker_loop(dispatcher, stop_event) for _ in range(ALERT_WORKER_SLOTS)))
+        finally:
+            await dispatcher.stop()
+            await close_async_client()
+            db_pool.close()
+            if metrics_server is not None:
+                metrics_server.close()
+
+def run_worker():
+    mark_startup()
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=LOG_LEVEL,
+        handlers=[
+            logging.FileHandler("logs/worker.log"),
+            logging.StreamHandler()
+        ]
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # One INFO line per HTTP request otherwise
+
+    async def main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        await run_worker_async(stop_event)
+
+    asyncio.run(main())
+
+if __name__ == "__main__":
+    run_worker()
@@ -0,0 +1,202 @@
+"""
+Lightweight in-process metrics: counters, gauges and latency histograms, rendered in the Prometheus text format.
+
+    FETCH_SECONDS = histogram("scraper_fetch_seconds", "InternSG page fetch latency")
+    with timed(FETCH_SECONDS, result="ok"):
+        ...
+"""
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; covers a cached lookup up to a slow multi-page crawl
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def total(self):
+        return sum(self._values.values())
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+class Gauge:
+    """A value that is set directly, or read from `func` at render time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, func=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self._values = {}
+
+    def set(self, value, **labels):
+        self._values[_label_key(labels)] = value
+
+    def samples(self):
+        if self.func is not None:
+            try:
+                return [(self.name, (), self.func())]
+            except Exception as e:
+                logging.warning(f"⚠️ Metric {self.name} failed: {e!r}")
+                return []
+        return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _bucket_counts(self, labels):
+        """Bucket counts for one label set; without labels, all series are combined."""
+        if labels:
+            series = self._series.get(_label_key(labels))
+            return series[:-1] if series else None
+        with self._lock:
+            all_series = list(self._series.values())
+        return [sum(counts) for counts in zip(*all_series)][:-1] if all_series else None
+
+    def count(self, **labels):
+        counts = self._bucket_counts(labels)
+        return sum(counts) if counts else 0
+
+    def quantile(self, q, **labels):
+        """Estimates a quantile from the buckets (upper bound of the bucket it falls in)."""
+        counts = self._bucket_counts(labels)
+        if not counts:
+            return None
+        target = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        samples = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                samples.append((f"{self.name}_bucket", key + (("le", le),), cumulative))
+            samples.append((f"{self.name}_sum", key, series[-1]))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, cls, name, help, **kwargs):
+        """Returns the metric called `name`, creating it on first use."""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name, help):
+    return REGISTRY.register(Counter, name, help)
+
+def gauge(name, help, func=None):
+    return REGISTRY.register(Gauge, name, help, func=func)
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram, name, help, buckets=buckets)
+
+@contextmanager
+def timed(metric, **labels):
+    """Observes the block's wall time in `metric`, also when it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - start, **labels)
+
+# --- Prometheus Endpoint ---
+async def _serve_metrics(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass  # Headers aren't needed
+
+        path = request_line.split()[1] if len(request_line.split()) > 1 else b"/"
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", REGISTRY.render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(port, host="0.0.0.0"):
+    """Serves GET /metrics on the running event loop. Returns the asyncio server; close() it on shutdown."""
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    logging.info(f"📈 Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
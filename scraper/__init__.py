@@ -1,15 +1,12 @@
-import logging
-from .utils import clean_text, make_request
+from .utils import clean_text
+from .scraper import scrape_internsg, crawl_all_listings_async
+from .sources import Source, register_source, get_source, enabled_sources, stream_source_results
+from .matching import ListingIndex
+from .parsers import JobRecord
 
 # Define what gets exposed when using `from scraper import *`
-__all__ = ["scrape_internsg", "clean_text", "make_request"]
-
-# Configure logging (applies to all scrapers)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("logs/scraper.log"),  # Saves logs to a file
-        logging.StreamHandler()  # Displays logs in the console
-    ]
-)
+__all__ = [
+    "scrape_internsg", "crawl_all_listings_async", "ListingIndex", "JobRecord",
+    "Source", "register_source", "get_source", "enabled_sources", "stream_source_results",
+    "clean_text"
+]
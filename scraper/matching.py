@@ -0,0 +1,80 @@
+import re
+import unicodedata
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+# Longest suffix first; each entry is (suffix, replacement, min length of the remaining stem)
+SUFFIXES = (
+    ("ies", "y", 3),
+    ("ing", "", 4),
+    ("s", "", 3),
+)
+
+def normalize(text):
+    """Case-folds text and strips accents, so 'Café' and 'cafe' match."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def stem(token):
+    """Very light suffix stripping: 'engineering' -> 'engineer', 'analysts' -> 'analyst'."""
+    if token.endswith("ss"):
+        return token
+    for suffix, replacement, min_stem in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= min_stem:
+            return token[:-len(suffix)] + replacement
+    return token
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_RE.findall(normalize(text or ""))]
+
+class ListingIndex:
+    """
+    In-memory inverted index over job title and company tokens.
+    Stores token positions so multi-word roles match as phrases ('data science' won't match 'science data').
+    """
+
+    def __init__(self, jobs=()):
+        self.jobs = []
+        self._postings = {}  # token -> {job index: [positions]}
+        for job in jobs:
+            self.add(job)
+
+    def add(self, job):
+        doc = len(self.jobs)
+        self.jobs.append(job)
+
+        title_tokens = tokenize(job.title)
+        # Company positions start after a gap so a phrase can't span title and company
+        fields = ((0, title_tokens), (len(title_tokens) + 1, tokenize(job.company)))
+        for offset, tokens in fields:
+            for position, token in enumerate(tokens, start=offset):
+                self._postings.setdefault(token, {}).setdefault(doc, []).append(position)
+
+    def match(self, role):
+        """Returns the jobs whose title or company contains every token of `role` as a phrase."""
+        tokens = tokenize(role)
+        if not tokens:
+            return []
+
+        postings = [self._postings.get(token) for token in tokens]
+        if not all(postings):
+            return []
+
+        # Intersect the shortest posting lists first
+        docs = set.intersection(*(set(posting) for posting in sorted(postings, key=len)))
+        if len(tokens) > 1:
+            docs = {doc for doc in docs if self._is_phrase(doc, postings)}
+        return [self.jobs[doc] for doc in sorted(docs)]
+
+    def match_all(self, roles):
+        """Returns {role: [jobs]} for every role, including roles with no matches."""
+        return {role: self.match(role) for role in roles}
+
+    @staticmethod
+    def _is_phrase(doc, postings):
+        starts = set(postings[0][doc])
+        for offset, posting in enumerate(postings[1:], start=1):
+            starts &= {position - offset for position in posting[doc]}
+            if not starts:
+                return False
+        return True
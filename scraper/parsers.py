@@ -0,0 +1,148 @@
+import os
+import logging
+from typing import NamedTuple
+from bs4 import BeautifulSoup
+from metrics import counter
+from .utils import clean_text
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional, html.parser always works
+    lxml = None
+
+ROW_SELECTOR = ".ast-row.list-odd, .ast-row.list-even"
+
+# Exceptions raised by a row that is missing one of the fields below
+MISSING_FIELD_ERRORS = (AttributeError, IndexError, KeyError, TypeError)
+
+ROWS_PARSED = counter("scraper_rows_total", "Listing rows extracted, by result: ok or skipped")
+
+class JobRecord(NamedTuple):
+    """One listing row. A tuple is a fraction of a dict's size, which adds up across the response cache."""
+    title: str
+    company: str
+    location: str
+    duration: str
+    post_date: str
+    link: str
+
+class ListingParser:
+    """Extracts job records from an InternSG listing page. Backends implement select_rows() and extract_row()."""
+    name = None
+
+    def select_rows(self, html):
+        raise NotImplementedError
+
+    def extract_row(self, row):
+        raise NotImplementedError
+
+    def iter_jobs(self, html):
+        """Yields one JobRecord per listing row, skipping rows with missing fields. Rows are only extracted on demand."""
+        for row in self.select_rows(html):
+            try:
+                job = self.extract_row(row)
+            except MISSING_FIELD_ERRORS as e:
+                ROWS_PARSED.inc(result="skipped")
+                logging.warning(f"⚠️ Skipping job due to missing fields: {e!r}")
+                continue  # Skip job listings that are missing required fields
+
+            ROWS_PARSED.inc(result="ok")
+            # Per-row logging is DEBUG only, it used to dominate the log on every poll
+            logging.debug(f"✅ Scraped job: {job.title} at {job.company}")
+            yield job
+
+    def parse(self, html):
+        """Returns one JobRecord per listing row, skipping rows with missing fields."""
+        return list(self.iter_jobs(html))
+
+def make_job(title, company, location, duration, post_date, raw_link):
+    """Builds the JobRecord every backend returns."""
+    return JobRecord(title, company, location, duration, post_date, raw_link.split("?")[0])
+
+class SoupParser(ListingParser):
+    """BeautifulSoup + CSS selectors, on top of any tree builder BeautifulSoup supports."""
+
+    def __init__(self, name, features):
+        self.name = name
+        self.features = features
+
+    def select_rows(self, html):
+        return BeautifulSoup(html, self.features).select(ROW_SELECTOR)
+
+    def extract_row(self, job):
+        # Extract company name
+        company = clean_text(job.select_one(".ast-col-lg-3").text.split("\n")[0])
+
+        # Extract job title and link
+        job_title_tag = job.select_one(".ast-col-lg-3 a")
+        title = clean_text(job_title_tag.text)
+        raw_link = job_title_tag['href']
+
+        # Extract location, duration and posting date
+        location = clean_text(job.select(".ast-col-lg-2 .job-listing-dt")[0].text)
+        duration = clean_text(job.select(".ast-col-lg-3 .job-listing-dt")[0].text)
+        post_date = clean_text(job.select(".ast-col-lg-1 span")[0].text)
+
+        return make_job(title, company, location, duration, post_date, raw_link)
+
+def _has_class(name):
+    """XPath predicate matching a single token of the class attribute, like a CSS class selector."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+class LxmlXPathParser(ListingParser):
+    """lxml with precompiled XPath, skipping the BeautifulSoup object model entirely."""
+    name = "lxml-xpath"
+
+    def __init__(self):
+        col3 = f".//*[{_has_class('ast-col-lg-3')}]"
+        self._rows = lxml.etree.XPath(
+            f"//*[{_has_class('ast-row')} and ({_has_class('list-odd')} or {_has_class('list-even')})]"
+        )
+        self._company = lxml.etree.XPath(col3)
+        self._title = lxml.etree.XPath(f"{col3}//a")
+        self._location = lxml.etree.XPath(f".//*[{_has_class('ast-col-lg-2')}]//*[{_has_class('job-listing-dt')}]")
+        self._duration = lxml.etree.XPath(f"{col3}//*[{_has_class('job-listing-dt')}]")
+        self._post_date = lxml.etree.XPath(f".//*[{_has_class('ast-col-lg-1')}]//span")
+
+    def select_rows(self, html):
+        if not html or not html.strip():
+            return []
+        return self._rows(lxml.html.document_fromstring(html))
+
+    def extract_row(self, job):
+        company = clean_text(_text(self._company(job)[0]).split("\n")[0])
+
+        job_title_tag = self._title(job)[0]
+        title = clean_text(_text(job_title_tag))
+        raw_link = job_title_tag.attrib["href"]
+
+        location = clean_text(_text(self._location(job)[0]))
+        duration = clean_text(_text(self._duration(job)[0]))
+        post_date = clean_text(_text(self._post_date(job)[0]))
+
+        return make_job(title, company, location, duration, post_date, raw_link)
+
+def _text(element):
+    """Same string BeautifulSoup's `.text` gives: all descendant text, comments excluded."""
+    return "".join(element.itertext())
+
+def available_parsers():
+    """Returns {name: parser} for every backend whose dependencies are installed."""
+    parsers = {"html.parser": SoupParser("html.parser", "html.parser")}
+    if lxml is not None:
+        parsers["lxml"] = SoupParser("lxml", "lxml")
+        parsers["lxml-xpath"] = LxmlXPathParser()
+    return parsers
+
+PARSERS = available_parsers()
+DEFAULT_PARSER = "lxml-xpath" if "lxml-xpath" in PARSERS else "html.parser"
+SCRAPER_PARSER = os.getenv("SCRAPER_PARSER", DEFAULT_PARSER)
+
+def get_parser(name=None):
+    """Looks up a backend by name, falling back to html.parser when it isn't available."""
+    name = name or SCRAPER_PARSER
+    parser = PARSERS.get(name)
+    if parser is None:
+        logging.warning(f"⚠️ HTML parser '{name}' is not available, falling back to html.parser")
+        parser = PARSERS["html.parser"]
+    return parser
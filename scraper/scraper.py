@@ -1,63 +1,59 @@
+import os
+import asyncio
 import logging
-from bs4 import BeautifulSoup
-from .utils import clean_text, make_request
+from .parsers import get_parser
+from .sources import Source, register_source
+from .utils import close_async_client
 import urllib
 
-def scrape_internsg(keywords):
-    """Scrapes InternSG for internships based on user keywords."""
-    base_url = "https://www.internsg.com/jobs/?f_0=1&f_p=&f_i=&filter_s={}"
-    internships = []
-
-    for keyword in keywords:
-        encoded_keyword = urllib.parse.quote_plus(keyword)
-        url = base_url.format(encoded_keyword)
-        logging.info(f"🔍 Scraping InternSG for keyword: {keyword}")
-
-        response = make_request(url)
-
-        if response.status_code != 200:
-            logging.error(f"❌ Failed to fetch {url} - Status Code: {response.status_code}")
-            continue
+# Point at a local fixture server for offline benchmarks and tests
+INTERNSG_URL = os.getenv("INTERNSG_URL", "https://www.internsg.com").rstrip("/")
+BASE_URL = INTERNSG_URL + "/jobs/?f_0=1&f_p=&f_i=&filter_s={}"
+PAGE_URL = INTERNSG_URL + "/jobs/{}/?f_0=1&f_p=&f_i=&filter_s={}"
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        job_listings = soup.select(".ast-row.list-odd, .ast-row.list-even")
+class InternSGSource(Source):
+    """internsg.com keyword search, the primary source."""
+    name = "internsg"
+    primary = True
 
-        logging.info(f"📌 Found {len(job_listings)} job listings for keyword: {keyword}")
+    def __init__(self, parser=None, **kwargs):
+        super().__init__(**kwargs)
+        self.parser = parser
 
-        for job in job_listings:
-            try:
-                # Extract company name
-                company = clean_text(job.select_one(".ast-col-lg-3").text.split("\n")[0])
-
-                # Extract job title and link
-                job_title_tag = job.select_one(".ast-col-lg-3 a")
-                title = clean_text(job_title_tag.text)
-                raw_link = job_title_tag['href']
-                clean_link = raw_link.split("?")[0]
+    def listing_url(self, keyword, page=1):
+        encoded_keyword = urllib.parse.quote_plus(keyword)
+        if page == 1:
+            return BASE_URL.format(encoded_keyword)
+        return PAGE_URL.format(page, encoded_keyword)
 
-                # Extract location
-                location = clean_text(job.select(".ast-col-lg-2 .job-listing-dt")[0].text)
+    def iter_jobs(self, html):
+        return get_parser(self.parser).iter_jobs(html)
 
-                # Extract job duration
-                duration = clean_text(job.select(".ast-col-lg-3 .job-listing-dt")[0].text)
+INTERNSG = register_source(InternSGSource())
 
-                # Extract job posting date
-                post_date = clean_text(job.select(".ast-col-lg-1 span")[0].text)
+def scrape_internsg(keywords):
+    """Scrapes InternSG for internships based on user keywords."""
+    return asyncio.run(_scrape_internsg(keywords))
 
-                internships.append({
-                    "title": title,
-                    "company": company,
-                    "location": location,
-                    "duration": duration,
-                    "post_date": post_date,
-                    "link": clean_link
-                })
+async def _scrape_internsg(keywords):
+    """Fetches the first listing page of each unique keyword concurrently, then releases the pooled clients."""
+    semaphore = asyncio.Semaphore(INTERNSG.concurrency)
 
-                logging.info(f"✅ Scraped job: {title} at {company}")
+    async def scrape_keyword(keyword):
+        async with semaphore:
+            logging.info(f"🔍 Scraping InternSG for keyword: {keyword}")
+            result = await INTERNSG.fetch_listing_page(INTERNSG.listing_url(keyword), keyword)
+            return result[0] if result is not None else []
 
-            except AttributeError as e:
-                logging.warning(f"⚠️ Skipping job due to missing fields: {e}")
-                continue  # Skip job listings that are missing required fields
+    try:
+        results = await asyncio.gather(*(scrape_keyword(keyword) for keyword in dict.fromkeys(keywords)))
+    finally:
+        await close_async_client()
 
+    internships = [job for jobs in results for job in jobs]
     logging.info(f"✅ Scraping completed! {len(internships)} internships found.")
     return internships
+
+async def crawl_all_listings_async(high_water_link=None):
+    """Crawls the unfiltered listing once, so roles can be matched locally with scraper.matching."""
+    return await INTERNSG.crawl("", high_water_link)
@@ -0,0 +1,246 @@
+"""
+Job sources. Every site the alert loop crawls is a Source subclass added to the registry with register_source().
+
+A source only supplies listing_url() and iter_jobs(). The fetch (response cache), parse (stop at the high-water mark)
+and normalize stages are shared. Each source runs under its own concurrency limit, connection pool, per-crawl timeout
+and circuit breaker, so a slow or broken site only delays its own keywords.
+"""
+import os
+import time
+import asyncio
+import logging
+from metrics import counter, histogram, timed
+from .utils import SCRAPER_CONCURRENCY, fetch_cached, get_async_client
+
+# Sources the alert loop crawls, by registry name
+SCRAPER_SOURCES = [name.strip() for name in os.getenv("SCRAPER_SOURCES", "internsg").split(",") if name.strip()]
+
+# Pages followed per keyword: until the high-water mark in steady state, or a fixed depth on a cold start
+SCRAPER_MAX_PAGES = int(os.getenv("SCRAPER_MAX_PAGES", "5"))
+SCRAPER_BACKFILL_PAGES = int(os.getenv("SCRAPER_BACKFILL_PAGES", "3"))
+
+# Isolation: a keyword's crawl is abandoned after SOURCE_TIMEOUT seconds, and a source is skipped for
+# SOURCE_BREAKER_RESET seconds after SOURCE_BREAKER_FAILURES failed crawls in a row
+SOURCE_TIMEOUT = float(os.getenv("SOURCE_TIMEOUT", "60"))
+SOURCE_BREAKER_FAILURES = int(os.getenv("SOURCE_BREAKER_FAILURES", "5"))
+SOURCE_BREAKER_RESET = float(os.getenv("SOURCE_BREAKER_RESET", "300"))
+
+PARSE_SECONDS = histogram("scraper_parse_seconds", "Listing page parse time")
+SOURCE_CRAWLS = counter("scraper_source_crawls_total", "Keyword crawls by source and result: ok, failed, timeout or skipped")
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failures; once `reset_after` seconds have passed, one trial call is let through."""
+
+    def __init__(self, failures=SOURCE_BREAKER_FAILURES, reset_after=SOURCE_BREAKER_RESET):
+        self.failure_threshold = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        """Returns True if this failure opened the breaker."""
+        self.failures += 1
+        if self._trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._trial = False
+            return True
+        return False
+
+class Source:
+    """
+    A job site. Subclasses set `name` and implement listing_url() and iter_jobs(); normalize() can clean up
+    records, e.g. strip tracking parameters from links.
+    """
+    name = None
+    primary = False  # The primary source's crawl state is keyed by the bare keyword, as before sources existed
+
+    def __init__(self, concurrency=None, timeout=SOURCE_TIMEOUT, breaker=None):
+        self.concurrency = concurrency or SCRAPER_CONCURRENCY
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+
+    def listing_url(self, keyword, page=1):
+        raise NotImplementedError
+
+    def iter_jobs(self, html):
+        """Yields a JobRecord per listing row, newest first."""
+        raise NotImplementedError
+
+    def normalize(self, job):
+        return job
+
+    def state_key(self, keyword):
+        """Key of the keyword's high-water mark and poll state in the keywords table."""
+        return keyword if self.primary else f"{self.name}:{keyword}"
+
+    # --- Shared stages ---
+    async def fetch(self, url):
+        """
+        Fetch stage: returns (entry, changed) from the shared response cache, entry is None on failure.
+        Requests go over the source's own connection pool, sized to its concurrency.
+        """
+        return await fetch_cached(url, client=get_async_client(self.name, self.concurrency))
+
+    def parse(self, html, keyword, stop_at=None):
+        """Parse stage: extracts normalized records, stopping after the row whose link is `stop_at`."""
+        jobs = []
+        with timed(PARSE_SECONDS, source=self.name):
+            for job in self.iter_jobs(html):
+                job = self.normalize(job)
+                jobs.append(job)
+                if job.link == stop_at:
+                    break
+        logging.debug(f"📌 Found {len(jobs)} {self.name} job listings for keyword: {keyword}")
+        return jobs
+
+    async def fetch_listing_page(self, url, keyword, stop_at=None):
+        """
+        Returns (jobs, reached_stop) for one listing page, or None if the fetch failed.
+        With `stop_at`, row extraction stops at that link and only the rows above it are returned.
+        """
+        entry, changed = await self.fetch(url)
+
+        if entry is None:
+            logging.error(f"❌ Failed to fetch {url}")
+            return None
+
+        # Same page as last poll: skip parsing when the cached rows reach far enough
+        if not changed and entry.parsed is not None and (entry.complete or _find_link(entry.parsed, stop_at) is not None):
+            logging.debug(f"♻️ Listing unchanged for keyword: {keyword}, reusing {len(entry.parsed)} cached jobs")
+        else:
+            entry.parsed = self.parse(entry.text, keyword, stop_at=stop_at)
+            entry.complete = _find_link(entry.parsed, stop_at) is None
+            if entry.complete:
+                entry.text = None  # Only the parsed jobs are needed from here on
+
+        index = _find_link(entry.parsed, stop_at)
+        if index is not None:
+            return entry.parsed[:index], True
+        return list(entry.parsed), False
+
+    async def crawl(self, keyword, high_water_link=None):
+        """
+        Follows a keyword's result pages until it reaches `high_water_link`, the newest link seen last time.
+        Returns (jobs newer than the high-water mark, new high-water link), or None if page 1 failed.
+        Without a high-water mark (cold start) it backfills SCRAPER_BACKFILL_PAGES pages.
+        """
+        max_pages = SCRAPER_MAX_PAGES if high_water_link else SCRAPER_BACKFILL_PAGES
+        logging.debug(f"🔍 Crawling {self.name} for keyword: {keyword} (up to {max_pages} pages)")
+        new_jobs = []
+
+        for page in range(1, max_pages + 1):
+            result = await self.fetch_listing_page(self.listing_url(keyword, page), keyword, stop_at=high_water_link)
+            if result is None:
+                if page == 1:
+                    return None
+                logging.warning(f"⚠️ Stopped crawling '{keyword}' on {self.name} at page {page}, older listings may be missed")
+                break
+
+            jobs, reached_high_water = result
+            new_jobs.extend(jobs)
+            if reached_high_water or not jobs:
+                break  # Caught up with the last crawl, or ran past the last page
+
+        new_high_water_link = new_jobs[0].link if new_jobs else high_water_link
+        return new_jobs, new_high_water_link
+
+    async def guarded_crawl(self, keyword, high_water_link=None):
+        """crawl() behind the source's circuit breaker and timeout. Returns None instead of raising."""
+        if not self.breaker.allow():
+            SOURCE_CRAWLS.inc(source=self.name, result="skipped")
+            return None
+
+        try:
+            result = await asyncio.wait_for(self.crawl(keyword, high_water_link), timeout=self.timeout)
+            outcome = "ok" if result is not None else "failed"
+        except asyncio.TimeoutError:
+            result, outcome = None, "timeout"
+            logging.warning(f"⚠️ Crawling '{keyword}' on {self.name} timed out after {self.timeout:g}s")
+        except Exception as e:
+            result, outcome = None, "failed"
+            logging.error(f"❌ Error crawling '{keyword}' on {self.name}: {e}", exc_info=True)
+
+        SOURCE_CRAWLS.inc(source=self.name, result=outcome)
+        if outcome == "ok":
+            self.breaker.record_success()
+        elif self.breaker.record_failure():
+            logging.warning(f"⚠️ Circuit breaker opened for {self.name}, skipping it for {self.breaker.reset_after:g}s")
+        return result
+
+def _find_link(jobs, link):
+    if link is None:
+        return None
+    for index, job in enumerate(jobs):
+        if job.link == link:
+            return index
+    return None
+
+# --- Registry ---
+SOURCES = {}
+
+def register_source(source):
+    """Adds a source instance to the registry under its name and returns it."""
+    SOURCES[source.name] = source
+    return source
+
+def get_source(name):
+    return SOURCES[name]
+
+def enabled_sources():
+    """The registered sources listed in SCRAPER_SOURCES, in that order."""
+    sources = []
+    for name in SCRAPER_SOURCES:
+        if name in SOURCES:
+            sources.append(SOURCES[name])
+        else:
+            logging.warning(f"⚠️ Unknown job source '{name}' in SCRAPER_SOURCES")
+    return sources
+
+async def stream_source_results(targets, concurrency=None):
+    """
+    Crawls {key: (source, keyword, high_water_link)} targets, each source under its own concurrency limit
+    (or `concurrency` for all of them). Yields {key: (new_jobs, new_high_water_link)} batches as crawls finish,
+    each holding every target that completed since the previous batch. Failed, timed-out and skipped targets
+    are left out.
+    """
+    semaphores = {}
+    for source, _, _ in targets.values():
+        if source.name not in semaphores:
+            semaphores[source.name] = asyncio.Semaphore(concurrency or source.concurrency)
+
+    async def crawl_with_limit(key, source, keyword, high_water_link):
+        async with semaphores[source.name]:
+            return key, await source.guarded_crawl(keyword, high_water_link)
+
+    pending = {asyncio.create_task(crawl_with_limit(key, *target)) for key, target in targets.items()}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            batch = dict(task.result() for task in done)
+            batch = {key: result for key, result in batch.items() if result is not None}
+            if batch:
+                yield batch
+    finally:
+        for task in pending:
+            task.cancel()  # The consumer stopped early
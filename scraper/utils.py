@@ -1,18 +1,162 @@
-import requests
-from requests.exceptions import RequestException
-
-def make_request(url):
-    """Safely makes a GET request and returns the response."""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+import httpx
+from metrics import counter, histogram, timed
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+REQUEST_TIMEOUT = 10
+
+# Max keywords fetched at the same time per source, also the size of each source's connection pool
+SCRAPER_CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", "5"))
+
+# Listing pages younger than the TTL are served from memory without any request
+SCRAPER_CACHE_TTL = float(os.getenv("SCRAPER_CACHE_TTL", "30"))
+SCRAPER_CACHE_SIZE = int(os.getenv("SCRAPER_CACHE_SIZE", "512"))
+
+FETCH_SECONDS = histogram("scraper_fetch_seconds", "InternSG HTTP request latency")
+FETCH_RESULTS = counter("scraper_fetches_total", "Listing page lookups by result: hit, not_modified, changed or error")
+
+# Pooled async clients by pool name (one per source), bound to the event loop that created them
+_async_clients = {}
+_async_client_loop = None
+
+def get_async_client(pool="default", max_connections=SCRAPER_CONCURRENCY):
+    """
+    Returns the keep-alive AsyncClient for `pool` on the running event loop. Sources each use their own pool,
+    so a slow site can only hold its own connections and never makes healthy sources wait for one.
+    """
+    global _async_clients, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client_loop is not loop:
+        _async_clients = {}  # Clients of a previous loop can't be used or closed from this one
+        _async_client_loop = loop
+
+    client = _async_clients.get(pool)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=REQUEST_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        _async_clients[pool] = client
+    return client
+
+async def close_async_client():
+    """Closes every pooled AsyncClient. Call before the owning event loop shuts down."""
+    global _async_clients, _async_client_loop
+    if _async_client_loop is asyncio.get_running_loop():
+        for client in _async_clients.values():
+            await client.aclose()
+    _async_clients = {}
+    _async_client_loop = None
+
+class CachedResponse:
+    """A cached page plus the validators needed to revalidate it."""
+    __slots__ = ("url", "text", "etag", "last_modified", "body_hash", "fetched_at", "parsed", "complete")
+
+    def __init__(self, url, text, etag, last_modified, body_hash, fetched_at):
+        self.url = url
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_hash = body_hash
+        self.fetched_at = fetched_at
+        self.parsed = None  # Filled in by callers that cache the parse result
+        self.complete = False  # Whether `parsed` covers the whole page or stopped early
+
+class ResponseCache:
+    """Bounded LRU cache of GET responses with a per-URL TTL."""
+
+    def __init__(self, max_size=SCRAPER_CACHE_SIZE, ttl=SCRAPER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0           # Served from memory inside the TTL
+        self.not_modified = 0   # Revalidated by 304 or an identical body hash
+        self.misses = 0         # New or changed body
+
+    def get(self, url):
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def put(self, entry):
+        self._entries[entry.url] = entry
+        self._entries.move_to_end(entry.url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def is_fresh(self, entry):
+        return time.monotonic() - entry.fetched_at < self.ttl
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+response_cache = ResponseCache()
+
+async def fetch_cached(url, client=None, cache=None):
+    """
+    Fetches a URL through the response cache.
+    Returns (entry, changed); entry is None if the request failed. `changed` is False when the
+    cached body is still current (inside the TTL, a 304, or an identical body hash).
+    """
+    cache = response_cache if cache is None else cache
+    entry = cache.get(url)
+
+    if entry is not None and cache.is_fresh(entry):
+        cache.hits += 1
+        FETCH_RESULTS.inc(result="hit")
+        return entry, False
+
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    client = client or get_async_client()
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        with timed(FETCH_SECONDS):
+            response = await client.get(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            entry.fetched_at = time.monotonic()
+            cache.not_modified += 1
+            FETCH_RESULTS.inc(result="not_modified")
+            return entry, False
         response.raise_for_status()
-        return response
-    except RequestException as e:
-        print(f"Request failed: {e}")
-        return None
+    except httpx.HTTPError as e:
+        FETCH_RESULTS.inc(result="error")
+        logging.warning(f"⚠️ Request failed: {url} - {e}")
+        return None, False
+
+    body_hash = hashlib.sha1(response.content).hexdigest()
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+
+    if entry is not None and entry.body_hash == body_hash:
+        entry.etag, entry.last_modified = etag, last_modified
+        entry.fetched_at = time.monotonic()
+        cache.not_modified += 1
+        FETCH_RESULTS.inc(result="not_modified")
+        return entry, False
+
+    entry = CachedResponse(url, response.text, etag, last_modified, body_hash, time.monotonic())
+    cache.put(entry)
+    cache.misses += 1
+    FETCH_RESULTS.inc(result="changed")
+    return entry, True
 
 def clean_text(text):
     """Cleans text by stripping whitespace and handling special characters."""
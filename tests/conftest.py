@@ -0,0 +1,41 @@
+import psycopg2.extensions
+import pytest
+
+import bot.config as config
+from benchmarks.fakes import disposable_postgres
+from bot.migrations import migrate
+
+TABLES = "users, users_jobs_sent, jobs, keywords, alert_shards, digest_queue, job_keywords, telegram_senders, alert_outbox"
+
+
+@pytest.fixture(scope="session")
+def postgres():
+    """A throwaway Postgres (or BENCH_DSN) with every migration applied. Yields its DSN; skips if none is available."""
+    server = disposable_postgres()
+    try:
+        dsn = server.__enter__()
+    except SystemExit as e:
+        pytest.skip(str(e))
+
+    params = psycopg2.extensions.parse_dsn(dsn)
+    settings = {name: getattr(config, name) for name in ("DB_NAME", "DB_USER", "DB_PASS", "DB_HOST", "DB_PORT")}
+    for name, key in (("DB_NAME", "dbname"), ("DB_USER", "user"), ("DB_PASS", "password"),
+                      ("DB_HOST", "host"), ("DB_PORT", "port")):
+        setattr(config, name, params.get(key) or None)
+    config.db_pool.close()
+    try:
+        migrate()
+        yield dsn
+    finally:
+        config.db_pool.close()
+        for name, value in settings.items():
+            setattr(config, name, value)
+        server.__exit__(None, None, None)
+
+
+@pytest.fixture
+def database(postgres):
+    """Empty tables for each test."""
+    with config.db_cursor() as cursor:
+        cursor.execute(f"TRUNCATE {TABLES}")
+    return postgres
@@ -0,0 +1,799 @@
+import asyncio
+import json
+import multiprocessing
+import socket
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import psycopg2
+import pytest
+
+from telegram import Update
+from telegram.error import Forbidden, NetworkError, RetryAfter
+from telegram.ext import Application, MessageHandler
+from telegram.request import BaseRequest
+
+from bot.bot import PerChatUpdateProcessor
+import bot.config as config
+from bot.catalog import (
+    KEYWORD_POLL_MAX, KEYWORD_POLL_MIN, SENT_HISTORY_LIMIT, find_unseen_links, ingest_jobs, link_hash,
+    load_high_water_links, route_new_jobs, update_keyword_stats
+)
+from bot.config import DatabasePool, PoolTimeout, db_cursor
+from bot.dispatcher import MessageDispatcher, TokenBucket
+from bot.digest import claim_due_digests, pack_digest, set_digest_mode
+import bot.handlers as handlers
+from bot.handlers import (
+    check_jobs_for_all_users, deliver_new_jobs, flush_due_digests, prune_all_sent_history, record_delivered_messages,
+    record_dropped_messages
+)
+from bot.migrations import MIGRATIONS, migrate
+from bot.profiles import ProfileCache, route_jobs_in_memory
+from bot.worker import claim_shard, ensure_shards, release_shard, renew_lease
+from scraper.parsers import JobRecord
+from scraper.sources import Source
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def message_update(update_id, chat_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": "hi", "chat": {"id": chat_id, "type": "private"}},
+    }, None)
+
+
+def test_link_hash_matches_postgres():
+    # SELECT ('x' || substr(md5(link), 1, 16))::bit(64)::bigint
+    assert link_hash("https://www.internsg.com/job/software-intern-1234/") == -9126738508190480492
+
+
+def test_migrations_are_numbered_in_order():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_update_processor_serializes_each_chat():
+    events = []
+
+    async def handle(name, delay):
+        events.append(f"start {name}")
+        await asyncio.sleep(delay)
+        events.append(f"end {name}")
+
+    async def run():
+        processor = PerChatUpdateProcessor(8)
+        await asyncio.gather(
+            processor.process_update(message_update(1, 100), handle("a1", 0.05)),
+            processor.process_update(message_update(2, 100), handle("a2", 0)),
+            processor.process_update(message_update(3, 200), handle("b1", 0.01)),
+        )
+        return processor
+
+    processor = asyncio.run(run())
+
+    # Chat 100's updates run one after the other and in order, chat 200 doesn't wait for them
+    assert events.index("end a1") < events.index("start a2")
+    assert events.index("end b1") < events.index("end a1")
+    assert processor._chat_locks == {}
+
+
+def test_chatty_chat_does_not_hold_other_chats_slots():
+    finished = {}
+
+    async def handle(name, delay):
+        await asyncio.sleep(delay)
+        finished[name] = time.monotonic()
+
+    async def run():
+        processor = PerChatUpdateProcessor(4)
+        start = time.monotonic()
+        # Eight queued updates from one chat used to take every slot while waiting for their chat lock
+        chatty = [processor.process_update(message_update(i, 100), handle(f"a{i}", 0.05)) for i in range(8)]
+        await asyncio.gather(*chatty, processor.process_update(message_update(8, 200), handle("b", 0.1)))
+        return start
+
+    start = asyncio.run(run())
+    assert finished["b"] - start < 0.2
+    assert finished["a7"] - start >= 0.4  # Chat 100 still runs one update at a time
+
+
+class FakeBotApi(BaseRequest):
+    """Answers Bot API calls offline and records the messages sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "InternBot", "username": "intern_bot"}
+        elif endpoint == "sendMessage":
+            self.sent.append((params["chat_id"], params["text"]))
+            result = {"message_id": len(self.sent), "date": 0, "chat": {"id": params["chat_id"], "type": "private"},
+                      "text": params["text"]}
+        else:  # setWebhook, deleteWebhook
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def test_webhook_handles_recorded_updates():
+    updates = json.loads((FIXTURES / "telegram_updates.json").read_text())
+    api = FakeBotApi()
+
+    async def echo(update, context):
+        await asyncio.sleep(0.01)
+        await context.bot.send_message(update.effective_chat.id, update.message.text)
+
+    async def run():
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        url = f"http://127.0.0.1:{port}/telegram"
+
+        app = (Application.builder().token("123:abc").request(api).get_updates_request(FakeBotApi())
+               .concurrent_updates(PerChatUpdateProcessor(4)).build())
+        app.add_handler(MessageHandler(None, echo))
+        async with app:
+            await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram",
+                                            webhook_url=url, secret_token="secret")
+            await app.start()
+            async with httpx.AsyncClient() as client:
+                rejected = await client.post(url, json=updates[0])
+                statuses = [(await client.post(url, json=update,
+                                               headers={"X-Telegram-Bot-Api-Secret-Token": "secret"})).status_code
+                            for update in updates]
+            for _ in range(100):
+                if len(api.sent) == len(updates):
+                    break
+                await asyncio.sleep(0.02)
+            await app.updater.stop()
+            await app.stop()
+        return rejected.status_code, statuses
+
+    rejected, statuses = asyncio.run(run())
+
+    assert rejected == 403
+    assert statuses == [200] * len(updates)
+    # Each chat's replies come back in the order its updates were posted
+    for chat_id in {update["message"]["chat"]["id"] for update in updates}:
+        assert [text for sent_to, text in api.sent if sent_to == chat_id] == \
+            [update["message"]["text"] for update in updates if update["message"]["chat"]["id"] == chat_id]
+
+
+def test_pack_digest_lists_each_job_once_within_the_limit():
+    jobs = [JobRecord(f"Intern {i}", "Acme", "Singapore", "3 Months", "1 Jan", f"https://example.com/{i}") for i in range(60)]
+    messages = pack_digest(jobs + jobs[:5], limit=1000)
+
+    assert all(len(text) <= 1000 for text, _ in messages)
+    assert [link for _, links in messages for link in links] == [job.link for job in jobs]
+    assert messages[0][0].startswith(f"📰 Job digest: 60 new jobs (1/{len(messages)})")
+    assert pack_digest(jobs[:1])[0][0].startswith("📰 Job digest: 1 new job\n\n🔹 Intern 0 at Acme")
+
+
+def test_pool_times_out_when_every_connection_is_busy(postgres):
+    pool = DatabasePool(minconn=0, maxconn=1, timeout=0.1)
+    conn = pool.acquire()
+    try:
+        with pytest.raises(PoolTimeout):
+            pool.acquire()
+    finally:
+        pool.release(conn)
+        pool.close()
+    assert pool.timeouts == 1
+
+
+def test_pool_reuses_released_connections(postgres):
+    pool = DatabasePool(minconn=0, maxconn=2)
+    try:
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        assert {id(pool.acquire()), id(pool.acquire())} == {id(first), id(second)}
+    finally:
+        pool.close()
+
+
+def test_pool_discards_a_broken_connection(postgres):
+    pool = DatabasePool(minconn=0, maxconn=2, healthcheck_idle=0)
+    try:
+        conn = pool.acquire()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            pid = cursor.fetchone()[0]
+        conn.rollback()
+        pool.release(conn)
+        with db_cursor() as cursor:  # e.g. a server restart or an idle timeout on the server side
+            cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        for _ in range(100):
+            with db_cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_stat_activity WHERE pid = %s", (pid,))
+                if cursor.fetchone() is None:
+                    break
+            time.sleep(0.01)
+
+        with pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            assert cursor.fetchone() == (1,)
+    finally:
+        pool.close()
+    assert pool.discarded == 1
+
+
+def test_pool_records_acquire_waits(postgres):
+    pool = DatabasePool(minconn=0, maxconn=1, timeout=5)
+    conn = pool.acquire()
+    threading.Timer(0.2, pool.release, (conn,)).start()  # Another thread finishing its query
+    try:
+        pool.release(pool.acquire())
+    finally:
+        pool.close()
+
+    stats = pool.stats()
+    assert stats["acquired"] == 2
+    assert stats["wait_max_ms"] >= 150
+    assert stats["wait_avg_ms"] == pytest.approx(pool.wait_total / 2 * 1000)
+    assert stats["timeouts"] == 0
+
+
+def posting(name):
+    return JobRecord(f"{name} intern", "Acme", "Singapore", "3 Months", "1 Jan", f"https://www.internsg.com/job/{name}/")
+
+
+def test_posting_is_new_once_per_keyword(database):
+    old, shared = posting("old"), posting("shared")
+    with db_cursor() as cursor:
+        # Baseline crawls, e.g. run by two different shards
+        assert ingest_jobs(cursor, {"software": ([old], old.link)}) == []
+        assert ingest_jobs(cursor, {"engineer": ([old], old.link)}) == []
+        assert ingest_jobs(cursor, {"linkedin:engineer": ([], None)}) == []
+
+        assert ingest_jobs(cursor, {"software": ([shared], shared.link)}) == [(shared, ["software"])]
+        # Stored by the other shard's cycle, but new for this keyword
+        assert ingest_jobs(cursor, {"linkedin:engineer": ([shared], shared.link)},
+                           roles_by_key={"linkedin:engineer": "engineer"}) == [(shared, ["engineer"])]
+        assert ingest_jobs(cursor, {"engineer": ([shared], shared.link)}) == []
+
+
+def test_old_postings_are_not_new_for_other_keywords(database):
+    old = posting("old")
+    with db_cursor() as cursor:
+        ingest_jobs(cursor, {"software": ([], None)})
+        ingest_jobs(cursor, {"data": ([], None)})
+        assert ingest_jobs(cursor, {"software": ([old], old.link)}) == [(old, ["software"])]
+
+        cursor.execute("UPDATE jobs SET first_seen_at = first_seen_at - interval '2 days'")
+        assert ingest_jobs(cursor, {"data": ([old], old.link)}) == []
+
+
+def test_migration_keeps_sent_history_stored_as_links(postgres, monkeypatch):
+    admin = psycopg2.connect(postgres)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute("DROP DATABASE IF EXISTS legacy_sent_history")
+        cursor.execute("CREATE DATABASE legacy_sent_history")
+
+    sent, unsent = posting("sent"), posting("unsent")
+    config.db_pool.close()
+    monkeypatch.setattr(config, "DB_NAME", "legacy_sent_history")
+    try:
+        with db_cursor() as cursor:  # The schema before migrations existed
+            cursor.execute("CREATE TABLE users (chat_id BIGINT PRIMARY KEY, roles TEXT[])")
+            cursor.execute("""
+                CREATE TABLE users_jobs_sent (
+                    chat_id BIGINT NOT NULL,
+                    job_link TEXT NOT NULL,
+                    sent_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (chat_id, job_link)
+                )
+            """)
+            cursor.execute("INSERT INTO users_jobs_sent (chat_id, job_link) VALUES (1, %s), (2, %s)",
+                           (sent.link, unsent.link))
+
+        assert migrate() == [version for version, _, _ in MIGRATIONS]
+
+        with db_cursor() as cursor:
+            assert find_unseen_links(cursor, 1, [sent.link, unsent.link]) == [unsent.link]
+            assert find_unseen_links(cursor, 2, [sent.link, unsent.link]) == [sent.link]
+            cursor.execute("SELECT to_regclass('users_jobs_sent_links')")
+            assert cursor.fetchone() == (None,)
+    finally:
+        config.db_pool.close()
+        monkeypatch.undo()
+        with admin.cursor() as cursor:
+            cursor.execute("DROP DATABASE legacy_sent_history")
+        admin.close()
+
+
+def test_prune_pass_keeps_the_newest_entries_of_every_user(database, monkeypatch):
+    monkeypatch.setattr(handlers, "SENT_HISTORY_PRUNE_BATCH", 2)  # Several batches for five users
+    history = {chat_id: SENT_HISTORY_LIMIT + chat_id * 10 - 20 for chat_id in range(1, 6)}
+    with db_cursor() as cursor:
+        for chat_id, entries in history.items():
+            cursor.execute("INSERT INTO users (chat_id, roles) VALUES (%s, %s)", (chat_id, ["software"]))
+            cursor.execute("""
+                INSERT INTO users_jobs_sent (chat_id, link_hash, sent_at)
+                SELECT %s, n, NOW() - make_interval(mins => n) FROM generate_series(1, %s) AS n
+            """, (chat_id, entries))
+
+    deleted = asyncio.run(prune_all_sent_history())
+
+    with db_cursor() as cursor:
+        cursor.execute("SELECT chat_id, COUNT(*), MAX(link_hash) FROM users_jobs_sent GROUP BY chat_id ORDER BY chat_id")
+        kept = cursor.fetchall()
+    assert kept == [(chat_id, min(entries, SENT_HISTORY_LIMIT), min(entries, SENT_HISTORY_LIMIT))
+                    for chat_id, entries in history.items()]
+    assert deleted == sum(max(0, entries - SENT_HISTORY_LIMIT) for entries in history.values())
+
+
+def poll_interval(cursor, keyword):
+    cursor.execute("SELECT poll_interval FROM keywords WHERE keyword = %s", (keyword,))
+    return cursor.fetchone()[0]
+
+
+def test_quiet_keyword_backs_off_to_the_ceiling_and_resets_on_new_links(database):
+    job = posting("new")
+    with db_cursor() as cursor:
+        assert update_keyword_stats(cursor, {"software": ([], None)}) == {"software"}
+        intervals = [poll_interval(cursor, "software")]
+        for _ in range(6):
+            update_keyword_stats(cursor, {"software": ([], None)})
+            intervals.append(poll_interval(cursor, "software"))
+
+        update_keyword_stats(cursor, {"software": ([job], job.link)})
+        assert poll_interval(cursor, "software") == KEYWORD_POLL_MIN
+        cursor.execute("SELECT high_water_link, new_jobs FROM keywords WHERE keyword = 'software'")
+        assert cursor.fetchone() == (job.link, 1)
+
+    expected = [KEYWORD_POLL_MIN]
+    while len(expected) < len(intervals):
+        expected.append(min(KEYWORD_POLL_MAX, expected[-1] * 2))
+    assert intervals == expected
+    assert intervals[-1] == KEYWORD_POLL_MAX
+
+
+def test_only_due_keywords_are_loaded(database):
+    with db_cursor() as cursor:
+        update_keyword_stats(cursor, {"fresh": ([], None), "quiet": ([], None), "stale": ([], None)})
+        update_keyword_stats(cursor, {"quiet": ([], None), "stale": ([], None)})  # Backed off to twice the floor
+        cursor.execute("""
+            UPDATE keywords SET last_scraped_at = NOW() - make_interval(secs => %s)
+            WHERE keyword IN ('quiet', 'stale')
+        """, (KEYWORD_POLL_MIN,))
+        cursor.execute("""
+            UPDATE keywords SET last_scraped_at = NOW() - make_interval(secs => %s) WHERE keyword = 'stale'
+        """, (KEYWORD_POLL_MIN * 2,))
+
+        # Never crawled keywords are always due, with no high-water mark yet
+        assert load_high_water_links(cursor, ["fresh", "quiet", "stale", "unseen"]) == {"stale": None, "unseen": None}
+
+
+class BrokenSource(Source):
+    name = "broken"
+    primary = True
+
+    def listing_url(self, keyword, page=1):
+        return f"https://example.com/{keyword}"
+
+    async def crawl(self, keyword, high_water_link=None):
+        raise RuntimeError("site down")
+
+
+def test_failed_crawl_leaves_the_keyword_due(database, monkeypatch):
+    monkeypatch.setattr(handlers, "enabled_sources", lambda: [BrokenSource()])
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles) VALUES (1, %s)", (["software"],))
+        update_keyword_stats(cursor, {"software": ([], "https://example.com/job/1")})
+        cursor.execute("UPDATE keywords SET last_scraped_at = NOW() - interval '1 hour' WHERE keyword = 'software'")
+
+    asyncio.run(check_jobs_for_all_users(MessageDispatcher(FakeBot())))
+
+    with db_cursor() as cursor:
+        assert load_high_water_links(cursor, ["software"]) == {"software": "https://example.com/job/1"}
+        cursor.execute("SELECT polls, last_scraped_at < NOW() - interval '59 minutes' FROM keywords")
+        assert cursor.fetchone() == (1, True)
+
+
+class FakeBot:
+    """Records sends; `failures` maps a message text or chat ID to the exceptions its next attempts raise."""
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        errors = self.failures.get(text) or self.failures.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def run_dispatcher(bot, messages, **kwargs):
+    """Queues (chat_id, text) messages, drains the dispatcher and returns (dispatcher, delivered messages)."""
+    delivered = []
+
+    async def on_delivered(batch):
+        delivered.extend(batch)
+
+    async def run():
+        dispatcher = MessageDispatcher(bot, on_delivered=on_delivered, **kwargs)
+        await dispatcher.start()
+        for chat_id, text in messages:
+            dispatcher.enqueue(chat_id, text, job_links=[text])
+        await dispatcher.stop()
+        return dispatcher
+
+    return asyncio.run(run()), delivered
+
+
+def test_token_bucket_paces_acquires():
+    async def acquire_all():
+        bucket = TokenBucket(rate=20, capacity=1)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire_all()) >= 0.18  # The first token is free, the other four take 1/20 s each
+
+
+def test_dispatcher_keeps_chat_order_across_retry_after():
+    bot = FakeBot({"a0": [RetryAfter(0.2)]})
+    messages = [(1, "a0"), (1, "a1"), (1, "a2"), (2, "b0")]
+    dispatcher, delivered = run_dispatcher(bot, messages, workers=4, chat_interval=0)
+
+    assert [text for chat_id, text in bot.sent if chat_id == 1] == ["a0", "a1", "a2"]
+    assert dispatcher.retry_after_waits == 1
+    assert sorted(message.text for message in delivered) == ["a0", "a1", "a2", "b0"]
+    assert not dispatcher.is_pending(1, "a0")
+
+
+def test_dispatcher_retries_network_errors_and_drops_forbidden():
+    bot = FakeBot({"flaky": [NetworkError("reset")], "blocked": [Forbidden("bot was blocked by the user")]})
+    dispatcher, delivered = run_dispatcher(bot, [(1, "flaky"), (2, "blocked")], workers=2, chat_interval=0)
+
+    assert bot.sent == [(1, "flaky")]
+    assert [message.text for message in delivered] == ["flaky"]
+    assert (dispatcher.retries, dispatcher.failed) == (1, 1)
+    assert not dispatcher.is_pending(2, "blocked")  # Whether it is tried again is up to on_dropped
+
+
+def test_dispatcher_serves_other_chats_while_one_waits_for_its_slot():
+    messages = [(1, "a0"), (1, "a1"), (1, "a2"), (2, "b0")]
+    bot = FakeBot()
+    run_dispatcher(bot, messages, workers=1, chat_interval=0.1)
+
+    # One worker: chat 1's held messages don't block chat 2 behind them
+    assert bot.sent.index((2, "b0")) < bot.sent.index((1, "a1"))
+    assert [text for chat_id, text in bot.sent if chat_id == 1] == ["a0", "a1", "a2"]
+
+
+def test_profile_cache_eviction_clears_complete():
+    cache = ProfileCache(max_size=2)
+    cache.warm([(1, ["software"]), (2, ["data"])])
+    assert cache.complete
+    assert cache.lookup(3) == (True, None)  # Known not to be subscribed while complete
+
+    cache.put(3, ["software"])
+
+    assert not cache.complete
+    assert cache.lookup(1) == (False, None)
+    assert set(cache.subscribers("software")) == {3}
+
+
+def test_profile_cache_unsubscribe_removes_role_index():
+    cache = ProfileCache()
+    cache.warm([(1, ["software", "data"]), (2, ["data"])])
+
+    cache.put(1, None)
+
+    assert cache.lookup(1) == (True, None)
+    assert cache.subscribers("software") == ()
+    assert set(cache.subscribers("data")) == {2}
+    assert cache.roles() == ["data"]
+
+
+def test_unsubscribed_chats_do_not_evict_a_complete_cache():
+    cache = ProfileCache(max_size=2)
+    cache.warm([(1, ["software"]), (2, ["data"])])
+
+    for chat_id in range(100, 110):  # /stop or delete clicks from chats that never subscribed
+        cache.put(chat_id, None)
+    cache.put(2, None)
+
+    assert cache.complete
+    assert len(cache) == 1
+    assert cache.lookup(1) == (True, ["software"])
+    assert cache.lookup(2) == cache.lookup(100) == (True, None)
+
+
+def test_route_jobs_in_memory_matches_database_routing(database):
+    profiles = [(1, ["software", "data"]), (2, ["data"]), (3, ["finance"]), (4, [])]
+    software, data, both = posting("software"), posting("data"), posting("both")
+    new_jobs = [(software, ["software"]), (data, ["data"]), (both, ["software", "data"])]
+    cache = ProfileCache()
+    cache.warm(profiles)
+
+    with db_cursor() as cursor:
+        for chat_id, roles in profiles:
+            cursor.execute("INSERT INTO users (chat_id, roles) VALUES (%s, %s)", (chat_id, roles))
+        from_database = route_new_jobs(cursor, new_jobs)
+
+    in_memory = route_jobs_in_memory(new_jobs, cache.snapshot(["software", "data"]))
+    assert {chat_id: sorted(jobs) for chat_id, jobs in in_memory.items()} == \
+        {chat_id: sorted(jobs) for chat_id, jobs in from_database.items()}
+    assert sorted(in_memory[1]) == sorted([software, data, both])  # Each job once, whichever roles matched it
+
+
+def test_immediate_digest_packs_every_batch_of_the_round(database):
+    software, data = posting("software"), posting("data")
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles, digest) VALUES (1, %s, 'immediate'), (2, %s, 'off')",
+                       (["software", "data"], ["software"]))
+        ingest_jobs(cursor, {"software": ([], None)})
+        ingest_jobs(cursor, {"data": ([], None)})
+
+    bot = FakeBot()
+
+    async def run():
+        dispatcher = MessageDispatcher(bot, chat_interval=0)
+        await dispatcher.start()
+        # Two batches, e.g. from different shards or sources
+        await deliver_new_jobs(dispatcher, {"software": ([software], software.link)}, None, set())
+        await deliver_new_jobs(dispatcher, {"data": ([data], data.link)}, None, set())
+        await asyncio.sleep(0.05)
+        sent_before_flush = list(bot.sent)
+        await flush_due_digests(dispatcher, {"immediate": 0})
+        await dispatcher.stop()
+        return sent_before_flush
+
+    assert [chat_id for chat_id, _ in asyncio.run(run())] == [2]
+    digests = [text for chat_id, text in bot.sent if chat_id == 1]
+    assert len(digests) == 1
+    assert digests[0].startswith("📰 Job digest: 2 new jobs") and software.link in digests[0] and data.link in digests[0]
+
+
+def digest_queue_size():
+    with db_cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM digest_queue")
+        return cursor.fetchone()[0]
+
+
+def test_switching_digests_off_sends_buffered_jobs_one_by_one(database, monkeypatch):
+    software, data = posting("software"), posting("data")
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles, digest) VALUES (1, %s, 'daily')", (["software"],))
+        ingest_jobs(cursor, {"software": ([], None)})
+
+    bot = FakeBot()
+    dispatcher = MessageDispatcher(bot, on_delivered=record_delivered_messages, chat_interval=0)
+
+    async def run():
+        await dispatcher.start()
+        await deliver_new_jobs(dispatcher, {"software": ([software, data], software.link)}, None, set())
+        assert digest_queue_size() == 2
+
+        with db_cursor() as cursor:
+            assert set_digest_mode(cursor, 1, "off")
+        assert digest_queue_size() == 0
+        await check_jobs_for_all_users(dispatcher)
+        await dispatcher.stop()
+
+    monkeypatch.setattr(handlers, "enabled_sources", lambda: [])
+    asyncio.run(run())
+
+    assert len(bot.sent) == 2 and all(text.startswith("🔥 New Job") for _, text in bot.sent)
+    assert outbox_rows() == []
+
+
+def test_rejected_digest_is_not_reclaimed(database):
+    software = posting("software")
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles, digest) VALUES (1, %s, 'immediate')", (["software"],))
+        ingest_jobs(cursor, {"software": ([], None)})
+
+    bot = FakeBot({1: [Forbidden("bot was blocked by the user")]})
+    dispatcher = MessageDispatcher(bot, on_delivered=record_delivered_messages, on_dropped=record_dropped_messages,
+                                   chat_interval=0)
+
+    async def run():
+        await dispatcher.start()
+        await deliver_new_jobs(dispatcher, {"software": ([software], software.link)}, None, set())
+        assert await flush_due_digests(dispatcher, {"immediate": 0}) == 1
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    assert bot.sent == []
+    assert digest_queue_size() == 0
+    with db_cursor() as cursor:
+        assert claim_due_digests(cursor, {"immediate": 0}, reclaim_after=0) == {}
+
+
+def outbox_rows():
+    with db_cursor() as cursor:
+        cursor.execute("SELECT chat_id, claimed_by FROM alert_outbox ORDER BY chat_id")
+        return cursor.fetchall()
+
+
+def test_alerts_lost_with_a_crashed_process_are_sent_next_cycle(database, monkeypatch):
+    software = posting("software")
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles) VALUES (1, %s)", (["software"],))
+        ingest_jobs(cursor, {"software": ([], None)})
+
+    bot = FakeBot()
+
+    async def run():
+        # Ingested and queued in memory, then the process dies before sending (it never registered, like a
+        # sender whose telegram_senders row has expired)
+        crashed = MessageDispatcher(bot, sender_id="crashed")
+        assert await deliver_new_jobs(crashed, {"software": ([software], software.link)}, None, set()) == 1
+        assert outbox_rows() == [(1, "crashed")]
+
+        restarted = MessageDispatcher(bot, on_delivered=record_delivered_messages, chat_interval=0, sender_id="restarted")
+        await restarted.start()
+        await check_jobs_for_all_users(restarted)
+        await check_jobs_for_all_users(restarted)  # Claimed by a live sender, not queued twice
+        await restarted.stop()
+
+    monkeypatch.setattr(handlers, "enabled_sources", lambda: [])  # Nothing new to crawl, only the outbox
+    asyncio.run(run())
+
+    assert len(bot.sent) == 1 and bot.sent[0][0] == 1 and software.link in bot.sent[0][1]
+    assert outbox_rows() == []
+    with db_cursor() as cursor:
+        assert find_unseen_links(cursor, 1, [software.link]) == []
+
+
+def test_given_up_alerts_are_resent_and_rejected_ones_forgotten(database, monkeypatch):
+    software = posting("software")
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles) VALUES (1, %s), (2, %s)", (["software"], ["software"]))
+        ingest_jobs(cursor, {"software": ([], None)})
+
+    bot = FakeBot({1: [NetworkError("reset")], 2: [Forbidden("bot was blocked by the user")]})
+    dispatcher = MessageDispatcher(bot, on_delivered=record_delivered_messages, on_dropped=record_dropped_messages,
+                                   chat_interval=0, max_retries=0, sender_id="bot")
+
+    async def run():
+        await dispatcher.start()
+        await deliver_new_jobs(dispatcher, {"software": ([software], software.link)}, None, set())
+        await dispatcher.stop()
+        assert bot.sent == []
+        assert outbox_rows() == [(1, None)]  # Released for any process; chat 2's alert is gone
+
+        await dispatcher.start()
+        await check_jobs_for_all_users(dispatcher)
+        await dispatcher.stop()
+
+    monkeypatch.setattr(handlers, "enabled_sources", lambda: [])
+    asyncio.run(run())
+
+    assert [chat_id for chat_id, _ in bot.sent] == [1]
+    assert outbox_rows() == []
+
+
+def test_failed_routing_keeps_the_postings_new(database, monkeypatch):
+    software = posting("software")
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles) VALUES (1, %s)", (["software"],))
+        ingest_jobs(cursor, {"software": ([], None)})
+
+    def load_digest_modes(cursor, chat_ids):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    async def run():
+        dispatcher = MessageDispatcher(FakeBot())
+        crawl_results = {"software": ([software], software.link)}
+        with monkeypatch.context() as patch:
+            patch.setattr(handlers, "load_digest_modes", load_digest_modes)
+            assert await deliver_new_jobs(dispatcher, crawl_results, None, set()) == 0
+        # Ingest, routing and the outbox share one transaction, so the retry still finds the posting new
+        return await deliver_new_jobs(dispatcher, crawl_results, None, set())
+
+    assert asyncio.run(run()) == 1
+    assert outbox_rows() == [(1, None)]
+
+
+def test_workers_routing_the_same_postings_alert_each_user_once(database):
+    postings = [posting(f"shared-{i}") for i in range(10)]
+    with db_cursor() as cursor:
+        cursor.execute("INSERT INTO users (chat_id, roles) VALUES (1, %s)", (["software", "data"],))
+        ingest_jobs(cursor, {"software": ([], None)})
+        ingest_jobs(cursor, {"data": ([], None)})
+
+    bot = FakeBot()
+
+    async def run():
+        # Two workers find the same postings through different keywords, both new to their keyword
+        workers = [MessageDispatcher(bot, on_delivered=record_delivered_messages, chat_interval=0, sender_id=worker_id)
+                   for worker_id in ("worker-0", "worker-1")]
+        for worker in workers:
+            await worker.start()
+        queued = await asyncio.gather(*(
+            deliver_new_jobs(worker, {keyword: (postings, postings[0].link)}, None, set())
+            for worker, keyword in zip(workers, ("software", "data"))
+        ))
+        for worker in workers:
+            await worker.stop()
+        return queued
+
+    assert sum(asyncio.run(run())) == len(postings)
+    assert len(bot.sent) == len({text for _, text in bot.sent}) == len(postings)
+
+
+def claim_until_empty(dsn, worker_id, shards, claimed):
+    """Worker process body: claims due shards over its own connection until none are left."""
+    conn = psycopg2.connect(dsn)
+    try:
+        while True:
+            with conn, conn.cursor() as cursor:
+                result = claim_shard(cursor, worker_id, 60, shards)
+            if result is None:
+                return
+            claimed.put((result[0], worker_id))
+            time.sleep(0.01)  # Hold the lease a moment, like a running cycle
+    finally:
+        conn.close()
+
+
+def test_workers_in_separate_processes_claim_each_shard_once(database):
+    shards = 12
+    with db_cursor() as cursor:
+        ensure_shards(cursor, shards, 0)
+
+    context = multiprocessing.get_context("fork")
+    claimed = context.Queue()
+    workers = [context.Process(target=claim_until_empty, args=(database, f"worker-{i}", shards, claimed))
+               for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    leases = [claimed.get(timeout=5) for _ in range(shards)]
+    assert sorted(shard for shard, _ in leases) == list(range(shards))
+    assert claimed.empty()
+
+
+def test_expired_lease_is_taken_over(database):
+    def run(func, *args):
+        with db_cursor() as cursor:  # One transaction per call, as in bot.worker
+            return func(cursor, *args)
+
+    run(ensure_shards, 1, 0)
+    assert run(claim_shard, "dead", 0, 1)[0] == 0
+    assert run(claim_shard, "alive", 60, 1)[0] == 0  # The zero-second lease has already expired
+    assert not run(renew_lease, 0, "dead", 60)
+    assert run(claim_shard, "other", 60, 1) is None
+
+    run(release_shard, 0, "alive", 60)
+    assert run(claim_shard, "other", 60, 1) is None  # Not due again for a minute
+
+
+def test_senders_split_the_global_rate(database):
+    async def run():
+        first = MessageDispatcher(FakeBot(), global_rate=30, sender_id="first")
+        second = MessageDispatcher(FakeBot(), global_rate=30, sender_id="second")
+        await first.start()
+        await second.start()
+        await first.share_rate()
+        rates = (first._bucket.rate, second._bucket.rate)
+        await second.stop()
+        await first.share_rate()
+        rate_alone = first._bucket.rate
+        await first.stop()
+        return rates, rate_alone
+
+    assert asyncio.run(run()) == ((15, 15), 30)
@@ -0,0 +1,47 @@
+from metrics import Counter, Histogram, Registry
+
+
+def test_histogram_quantiles_and_count():
+    latency = Histogram("fetch_seconds", "test", buckets=(0.01, 0.1, 1))
+    for value in [0.005] * 90 + [0.05] * 8 + [0.5, 5]:
+        latency.observe(value)
+
+    assert latency.count() == 100
+    assert latency.quantile(0.5) == 0.01
+    assert latency.quantile(0.95) == 0.1
+    assert latency.quantile(1.0) == float("inf")
+    assert latency.quantile(0.5, result="error") is None
+
+
+def test_histogram_combines_labelled_series():
+    latency = Histogram("query_seconds", "test", buckets=(0.01, 0.1))
+    latency.observe(0.005, query="a")
+    latency.observe(0.05, query="b")
+    latency.observe(0.05, query="b")
+
+    assert latency.count(query="a") == 1
+    assert latency.count() == 3
+    assert latency.quantile(0.5) == 0.1
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    sends = registry.register(Counter, "messages_total", "Messages sent")
+    sends.inc(result="sent")
+    sends.inc(2, result='say "hi"')
+    latency = registry.register(Histogram, "send_seconds", "Send latency", buckets=(0.1,))
+    latency.observe(0.05)
+
+    assert registry.register(Counter, "messages_total", "ignored") is sends
+    assert registry.render().splitlines() == [
+        "# HELP messages_total Messages sent",
+        "# TYPE messages_total counter",
+        'messages_total{result="say \\"hi\\""} 2',
+        'messages_total{result="sent"} 1',
+        "# HELP send_seconds Send latency",
+        "# TYPE send_seconds histogram",
+        'send_seconds_bucket{le="0.1"} 1',
+        'send_seconds_bucket{le="+Inf"} 1',
+        "send_seconds_sum 0.05",
+        "send_seconds_count 1",
+    ]
@@ -0,0 +1,263 @@
+import asyncio
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+import scraper.scraper as scraper
+from scraper.matching import ListingIndex
+from scraper.parsers import PARSERS, JobRecord, get_parser
+from scraper.sources import CircuitBreaker, Source, stream_source_results
+from scraper.utils import CachedResponse, ResponseCache, close_async_client, fetch_cached, response_cache
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def load_fixture(name):
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+@pytest.mark.parametrize("fixture", ["internsg_software.html", "internsg_empty.html", "internsg_edge_cases.html"])
+def test_parser_backends_produce_identical_jobs(fixture):
+    html = load_fixture(fixture)
+    expected = PARSERS["html.parser"].parse(html)
+
+    for name, parser in PARSERS.items():
+        assert parser.parse(html) == expected, name
+
+
+def test_listing_page_rows():
+    jobs = PARSERS["html.parser"].parse(load_fixture("internsg_software.html"))
+
+    assert len(jobs) == 50
+    assert len({job.link for job in jobs}) == 50
+    assert all("?" not in job.link for job in jobs)
+    assert all(isinstance(job, JobRecord) for job in jobs)
+
+
+def test_edge_case_rows():
+    jobs = PARSERS["html.parser"].parse(load_fixture("internsg_edge_cases.html"))
+
+    # Rows missing a link or a location are skipped, lookalike classes are ignored
+    assert [job.link for job in jobs] == [
+        "https://www.internsg.com/job/att-rd-software-intern-8001/",
+        "https://www.internsg.com/job/cafe-societe-software-8003/",
+        "https://www.internsg.com/job/acme-robotics-embedded-8004/",
+    ]
+    assert jobs[0].title == "R&D Software Intern"
+    assert jobs[1].company == "Café Société Pte. Ltd."
+    assert jobs[1].duration == "3 - 6 Months"
+
+
+def test_unknown_parser_falls_back_to_html_parser():
+    assert get_parser("does-not-exist") is PARSERS["html.parser"]
+
+
+def test_listing_index_matches_stems_case_and_accents():
+    jobs = PARSERS["html.parser"].parse(load_fixture("internsg_edge_cases.html"))
+    index = ListingIndex(jobs)
+
+    assert index.match("SOFTWARE") == index.match("softwares") == jobs
+    assert index.match("cafe societe") == index.match("point of sales") == [jobs[1]]
+    assert index.match("nonexistent role") == []
+    assert index.match("  ") == []
+
+
+def test_listing_index_matches_phrases_in_order():
+    jobs = [
+        JobRecord("Data Science Intern", "Acme", "", "", "", "a"),
+        JobRecord("Science Data Curator", "Acme", "", "", "", "b"),
+        JobRecord("Data Intern", "Science Labs", "", "", "", "c"),
+        JobRecord("Engineering Intern", "Acme", "", "", "", "d"),
+    ]
+    index = ListingIndex(jobs)
+
+    assert [job.link for job in index.match("data science")] == ["a"]
+    assert [job.link for job in index.match("engineers")] == ["d"]
+    assert index.match_all(["acme", "finance"]) == {"acme": [jobs[0], jobs[1], jobs[3]], "finance": []}
+
+
+class FakeSource(Source):
+    """Crawls return after `delays[keyword]` seconds; keywords missing from `delays` fail."""
+
+    def __init__(self, name, delays, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.delays = delays
+
+    async def crawl(self, keyword, high_water_link=None):
+        if keyword not in self.delays:
+            raise RuntimeError("site down")
+        await asyncio.sleep(self.delays[keyword])
+        return [], f"{self.name}-{keyword}-link"
+
+
+def test_stream_source_results_yields_keywords_as_they_finish():
+    fast = FakeSource("fast", {"a": 0.0, "slow": 0.2})
+    broken = FakeSource("broken", {"hangs": 5}, timeout=0.05)
+    targets = {
+        "a": (fast, "a", None),
+        "slow": (fast, "slow", None),
+        "broken:a": (broken, "a", None),
+        "broken:hangs": (broken, "hangs", None),
+    }
+
+    async def collect():
+        return [batch async for batch in stream_source_results(targets)]
+
+    # Failed and timed-out crawls are left out without holding back the healthy source
+    assert asyncio.run(collect()) == [{"a": ([], "fast-a-link")}, {"slow": ([], "fast-slow-link")}]
+    assert broken.breaker.failures == 2
+
+
+def test_circuit_breaker_skips_failing_source_until_reset():
+    source = FakeSource("flaky", {}, breaker=CircuitBreaker(failures=2, reset_after=0.05))
+
+    async def crawl_three_times():
+        return [await source.guarded_crawl("role") for _ in range(3)]
+
+    assert asyncio.run(crawl_three_times()) == [None, None, None]
+    assert source.breaker.failures == 2  # The third crawl was skipped, not attempted
+    assert source.breaker.state == "open"
+
+    time.sleep(0.06)
+    assert source.breaker.state == "half-open"
+    source.delays["role"] = 0.0
+    assert asyncio.run(source.guarded_crawl("role")) == ([], "flaky-role-link")
+    assert source.breaker.state == "closed"
+
+
+def test_internsg_source_crawls_fixture_pages_until_high_water(monkeypatch):
+    source = scraper.InternSGSource()
+    page = load_fixture("internsg_software.html")
+    jobs = PARSERS["html.parser"].parse(page)
+    fetched = []
+
+    async def fake_fetch(url):
+        fetched.append(url)
+        return CachedResponse(url, page, None, None, None, 0), True
+
+    monkeypatch.setattr(source, "fetch", fake_fetch)
+    new_jobs, high_water_link = asyncio.run(source.crawl("software", jobs[3].link))
+
+    assert new_jobs == jobs[:3]
+    assert high_water_link == jobs[0].link
+    assert fetched == [scraper.BASE_URL.format("software")]
+    assert source.state_key("software") == "software"
+    assert FakeSource("other", {}).state_key("software") == "other:software"
+
+
+def test_slow_source_does_not_hold_other_sources_connections():
+    async def handle(reader, writer):
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        if b"/slow" in request_line:
+            await asyncio.sleep(0.5)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        base = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        slow, fast = FakeSource("slow", {}, concurrency=2), FakeSource("fast", {}, concurrency=2)
+        try:
+            hanging = [asyncio.create_task(slow.fetch(f"{base}/slow/{i}")) for i in range(2)]
+            await asyncio.sleep(0.05)
+            start = time.monotonic()
+            entry, _ = await fast.fetch(f"{base}/fast")
+            elapsed = time.monotonic() - start
+            await asyncio.gather(*hanging)
+        finally:
+            await close_async_client()
+            server.close()
+            response_cache.clear()
+        return entry.text, elapsed
+
+    text, elapsed = asyncio.run(run())
+    assert text == "ok"
+    assert elapsed < 0.3  # The slow source's two requests fill only its own pool
+
+
+class FakeListingServer:
+    """httpx transport that serves `body` with an ETag and answers 304 when the client sends it back."""
+
+    def __init__(self, body, etag='"v1"'):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+
+    def handle(self, request):
+        self.requests.append(request)
+        if self.etag and request.headers.get("If-None-Match") == self.etag:
+            return httpx.Response(304)
+        headers = {"ETag": self.etag} if self.etag else {}
+        return httpx.Response(200, text=self.body, headers=headers)
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+
+def fetch_all(server, urls, cache):
+    async def run():
+        async with server.client() as client:
+            return [await fetch_cached(url, client=client, cache=cache) for url in urls]
+    return asyncio.run(run())
+
+
+def test_fetch_cached_serves_fresh_entries_from_memory():
+    server = FakeListingServer("<html>v1</html>")
+    cache = ResponseCache(ttl=60)
+
+    (first, first_changed), (second, second_changed) = fetch_all(server, ["https://x/a", "https://x/a"], cache)
+
+    assert first_changed and not second_changed
+    assert second is first
+    assert len(server.requests) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_fetch_cached_revalidates_stale_entries_with_etag():
+    server = FakeListingServer("<html>v1</html>")
+    cache = ResponseCache(ttl=0)
+
+    (first, _), (second, changed) = fetch_all(server, ["https://x/a", "https://x/a"], cache)
+
+    assert server.requests[1].headers["If-None-Match"] == '"v1"'
+    assert second is first and not changed
+    assert cache.not_modified == 1
+
+
+def test_fetch_cached_detects_identical_body_without_validators():
+    server = FakeListingServer("<html>v1</html>", etag=None)
+    cache = ResponseCache(ttl=0)
+
+    (first, _), (same, same_changed) = fetch_all(server, ["https://x/a", "https://x/a"], cache)
+    server.body = "<html>v2</html>"
+    [(updated, updated_changed)] = fetch_all(server, ["https://x/a"], cache)
+
+    assert same is first and not same_changed
+    assert updated_changed and updated.text == "<html>v2</html>"
+    assert (cache.not_modified, cache.misses) == (1, 2)
+
+
+def test_fetch_cached_evicts_least_recently_used():
+    server = FakeListingServer("<html>v1</html>")
+    cache = ResponseCache(max_size=2, ttl=60)
+
+    fetch_all(server, ["https://x/a", "https://x/b", "https://x/a", "https://x/c"], cache)
+
+    assert cache.get("https://x/b") is None  # "a" was used again after "b"
+    assert cache.get("https://x/a") is not None and cache.get("https://x/c") is not None
+    assert len(cache) == 2
+
+
+def test_fetch_cached_reports_errors_without_caching():
+    server = FakeListingServer("")
+    server.handle = lambda request: httpx.Response(503)
+    cache = ResponseCache()
+
+    assert fetch_all(server, ["https://x/a"], cache) == [(None, False)]
+    assert len(cache) == 0